@@ -1,14 +1,12 @@
 from fastapi import APIRouter, HTTPException, status, Depends
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from app.models.user import UserCreate, UserLogin, UserResponse
 from app.models.auth import Token, TokenRefresh, MessageResponse
 from app.services.auth_service import auth_service
-from app.api.deps import get_current_user
+from app.api.deps import bearer_token, get_current_user
 
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
-security = HTTPBearer()
 
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
@@ -56,11 +54,9 @@ async def refresh_token(data: TokenRefresh):
 
 
 @router.post("/logout", response_model=MessageResponse)
-async def logout(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-):
+async def logout(token: str = Depends(bearer_token)):
     """Logout and invalidate current token."""
-    success = await auth_service.logout(credentials.credentials)
+    success = await auth_service.logout(token)
     
     if not success:
         raise HTTPException(
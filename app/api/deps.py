@@ -1,6 +1,7 @@
-from typing import Optional
-from fastapi import Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import asyncio
+import re
+from typing import Awaitable, Callable, Optional
+from fastapi import Depends, Header, HTTPException, Request, status
 
 from app.core.security import decode_token
 from app.services.auth_service import auth_service
@@ -8,27 +9,40 @@ from app.services.permission_service import permission_service
 from app.services.directory_service import directory_service
 from app.models.user import UserResponse
 from app.models.permission import PermissionType
-from app.models.role import UserRole, has_permission
-from app.db.mongodb import get_token_blacklist_collection
+from app.models.role import ADMIN_ROLES, RolePermission, UserRole, has_permission
 
 
-security = HTTPBearer()
+# "Bearer <jwt>", case-insensitive scheme, any spaces/tabs around the token
+_BEARER_RE = re.compile(r"(?i:bearer)[ \t]+([A-Za-z0-9._\-]+)[ \t]*")
 
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-) -> UserResponse:
-    """Get current authenticated user from JWT token."""
-    token = credentials.credentials
-    
-    # Check if token is blacklisted
-    blacklist = get_token_blacklist_collection()
-    if await blacklist.find_one({"token": token}):
+async def optional_bearer_token(
+    authorization: Optional[str] = Header(None),
+) -> Optional[str]:
+    """Extract the bearer token from the Authorization header, if present."""
+    if not authorization:
+        return None
+    match = _BEARER_RE.fullmatch(authorization)
+    return match.group(1) if match else None
+
+
+async def bearer_token(
+    token: Optional[str] = Depends(optional_bearer_token),
+) -> str:
+    """Extract the bearer token from the Authorization header."""
+    if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token has been revoked",
+            detail="Missing bearer token",
+            headers={"WWW-Authenticate": "Bearer"},
         )
-    
+    return token
+
+
+async def get_current_user(
+    token: str = Depends(bearer_token),
+) -> UserResponse:
+    """Get current authenticated user from JWT token."""
     # Decode token
     payload = decode_token(token)
     if not payload:
@@ -43,8 +57,20 @@ async def get_current_user(
             detail="Invalid token type",
         )
     
+    # Blacklist and user lookups are independent, run them concurrently
+    revoked, user = await asyncio.gather(
+        auth_service.is_token_blacklisted(token),
+        auth_service.get_user_from_token(payload),
+    )
+    
+    # Check if token is blacklisted
+    if revoked:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked",
+        )
+    
     # Get user
-    user = await auth_service.get_user_by_id(payload.sub)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -62,16 +88,14 @@ async def get_current_user(
 
 
 async def get_current_user_optional(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(
-        HTTPBearer(auto_error=False)
-    ),
+    token: Optional[str] = Depends(optional_bearer_token),
 ) -> Optional[UserResponse]:
     """Get current user if authenticated, None otherwise."""
-    if not credentials:
+    if not token:
         return None
     
     try:
-        return await get_current_user(credentials)
+        return await get_current_user(token)
     except HTTPException:
         return None
 
@@ -80,7 +104,7 @@ async def require_admin(
     current_user: UserResponse = Depends(get_current_user),
 ) -> UserResponse:
     """Require admin or super_admin role."""
-    if current_user.role not in (UserRole.ADMIN, UserRole.SUPER_ADMIN):
+    if current_user.role not in ADMIN_ROLES:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required",
@@ -100,52 +124,86 @@ async def require_super_admin(
     return current_user
 
 
-class PermissionChecker:
-    """Dependency class for checking permissions."""
-    
-    def __init__(self, permission_type: PermissionType):
-        self.permission_type = permission_type
+async def get_rbac_cache(request: Request) -> dict:
+    """Get the per-request cache for RBAC lookups."""
+    cache = getattr(request.state, "rbac_cache", None)
+    if cache is None:
+        cache = request.state.rbac_cache = {}
+    return cache
+
+
+async def cached_check(
+    cache: dict,
+    key: tuple,
+    check: Callable[[], Awaitable[bool]],
+) -> bool:
+    """Run an RBAC lookup once per request, reusing the cached result."""
+    if key not in cache:
+        cache[key] = await check()
+    return cache[key]
+
+
+def permission_checker(permission_type: PermissionType):
+    """Build a dependency that checks the given directory permission."""
+    required = RolePermission[permission_type.name]
     
-    async def __call__(
-        self,
+    async def check(
         directory_id: str,
         current_user: UserResponse = Depends(get_current_user),
+        cache: dict = Depends(get_rbac_cache),
     ) -> bool:
         """Check if current user has required permission."""
         # Super admin always has all permissions
         if current_user.role == UserRole.SUPER_ADMIN:
             return True
         
-        # Check if directory is public (for read/write permissions)
-        if self.permission_type in (PermissionType.READ, PermissionType.WRITE):
-            is_public = await directory_service.is_public(directory_id)
+        check_owner = cached_check(
+            cache,
+            ("owner", directory_id, current_user.id),
+            lambda: directory_service.is_owner(directory_id, current_user.id),
+        )
+        
+        # Check if directory is public (for read/write permissions).
+        # Public and owner lookups are independent, so run them concurrently.
+        if permission_type in (PermissionType.READ, PermissionType.WRITE):
+            is_public, is_owner = await asyncio.gather(
+                cached_check(
+                    cache,
+                    ("public", directory_id),
+                    lambda: directory_service.is_public(directory_id),
+                ),
+                check_owner,
+            )
             if is_public:
                 return True
+        else:
+            is_owner = await check_owner
         
         # Admins have all permissions on their own directories
-        if current_user.role == UserRole.ADMIN:
-            is_owner = await directory_service.is_owner(directory_id, current_user.id)
-            if is_owner:
-                return True
+        if current_user.role == UserRole.ADMIN and is_owner:
+            return True
         
         # Check role-based permissions first
-        permission_name = self.permission_type.value
-        if not has_permission(current_user.role, permission_name):
+        permission_name = permission_type.value
+        if not has_permission(current_user.role, required):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Your role does not have {permission_name} permission",
             )
         
         # Check if owner
-        is_owner = await directory_service.is_owner(directory_id, current_user.id)
         if is_owner:
             return True
         
         # Then check directory-specific permissions (shared)
-        has_perm = await permission_service.check_permission(
-            user_id=current_user.id,
-            directory_id=directory_id,
-            permission_type=self.permission_type,
+        has_perm = await cached_check(
+            cache,
+            ("perm", directory_id, current_user.id, permission_type),
+            lambda: permission_service.check_permission(
+                user_id=current_user.id,
+                directory_id=directory_id,
+                permission_type=permission_type,
+            ),
         )
         
         if not has_perm:
@@ -155,9 +213,11 @@ class PermissionChecker:
             )
         
         return True
+    
+    return check
 
 
 # Pre-configured permission checkers
-require_read = PermissionChecker(PermissionType.READ)
-require_write = PermissionChecker(PermissionType.WRITE)
-require_delete = PermissionChecker(PermissionType.DELETE)
+require_read = permission_checker(PermissionType.READ)
+require_write = permission_checker(PermissionType.WRITE)
+require_delete = permission_checker(PermissionType.DELETE)
@@ -66,6 +66,16 @@ async def get_directory(
     current_user: UserResponse = Depends(get_current_user),
 ):
     """Get a specific directory."""
+    # Super admin can access all
+    if current_user.role == UserRole.SUPER_ADMIN:
+        directory = await directory_service.get_directory(directory_id)
+        if not directory:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Directory not found",
+            )
+        return directory
+    
     directory = await directory_service.get_directory(directory_id)
     if not directory:
         raise HTTPException(
@@ -73,10 +83,6 @@ async def get_directory(
             detail="Directory not found",
         )
     
-    # Super admin can access all
-    if current_user.role == UserRole.SUPER_ADMIN:
-        return directory
-    
     # Public directories accessible to all
     if directory.is_public:
         return directory
@@ -90,6 +96,7 @@ async def get_directory(
         user_id=current_user.id,
         directory_id=directory_id,
     )
+    
     if not can_access:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -125,6 +132,11 @@ async def update_directory(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=str(e),
         )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
 
 
 @router.delete("/{directory_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -1,3 +1,4 @@
+import asyncio
 from typing import List
 from fastapi import APIRouter, HTTPException, status, Depends
 
@@ -16,7 +17,7 @@ from app.services.file_service import file_service
 from app.services.directory_service import directory_service
 from app.services.permission_service import permission_service
 from app.models.permission import PermissionType
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, get_rbac_cache, cached_check
 
 
 router = APIRouter(prefix="/files", tags=["Files"])
@@ -26,28 +27,47 @@ async def check_file_permission(
     user: UserResponse,
     directory_id: str,
     permission_type: PermissionType,
+    cache: dict,
 ) -> bool:
     """Check if user has permission for directory, considering role and public status."""
     # Super admin has all permissions
     if user.role == UserRole.SUPER_ADMIN:
         return True
     
-    # Check if directory is public (read-only)
+    check_owner = cached_check(
+        cache,
+        ("owner", directory_id, user.id),
+        lambda: directory_service.is_owner(directory_id, user.id),
+    )
+    
+    # Check if directory is public (read-only), concurrently with ownership
     if permission_type == PermissionType.READ:
-        is_public = await directory_service.is_public(directory_id)
+        is_public, is_owner = await asyncio.gather(
+            cached_check(
+                cache,
+                ("public", directory_id),
+                lambda: directory_service.is_public(directory_id),
+            ),
+            check_owner,
+        )
         if is_public:
             return True
+    else:
+        is_owner = await check_owner
     
     # Check if user is owner
-    is_owner = await directory_service.is_owner(directory_id, user.id)
     if is_owner:
         return True
     
     # Check shared permissions
-    return await permission_service.check_permission(
-        user_id=user.id,
-        directory_id=directory_id,
-        permission_type=permission_type,
+    return await cached_check(
+        cache,
+        ("perm", directory_id, user.id, permission_type),
+        lambda: permission_service.check_permission(
+            user_id=user.id,
+            directory_id=directory_id,
+            permission_type=permission_type,
+        ),
     )
 
 
@@ -55,11 +75,12 @@ async def check_file_permission(
 async def request_upload_url(
     data: FileUploadRequest,
     current_user: UserResponse = Depends(get_current_user),
+    rbac_cache: dict = Depends(get_rbac_cache),
 ):
     """Request a presigned URL for file upload."""
     # Check write permission
     has_perm = await check_file_permission(
-        current_user, data.directory_id, PermissionType.WRITE
+        current_user, data.directory_id, PermissionType.WRITE, rbac_cache
     )
     if not has_perm:
         raise HTTPException(
@@ -107,25 +128,28 @@ async def confirm_upload(
 async def get_preview_url(
     file_id: str,
     current_user: UserResponse = Depends(get_current_user),
+    rbac_cache: dict = Depends(get_rbac_cache),
 ):
     """Get a presigned URL for file preview (inline)."""
-    # Get file to check directory
-    file_doc = await file_service.get_file(file_id)
-    if not file_doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="File not found",
-        )
-    
-    # Check read permission
-    has_perm = await check_file_permission(
-        current_user, file_doc["directory_id"], PermissionType.READ
-    )
-    if not has_perm:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="No read permission for this file",
+    # Super admin skips the lookup; the service 404s on a missing file
+    if current_user.role != UserRole.SUPER_ADMIN:
+        # Get file directory for the permission check
+        directory_id = await file_service.get_file_dir(file_id)
+        if not directory_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+        
+        # Check read permission
+        has_perm = await check_file_permission(
+            current_user, directory_id, PermissionType.READ, rbac_cache
         )
+        if not has_perm:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="No read permission for this file",
+            )
     
     try:
         return await file_service.get_preview_url(file_id)
@@ -140,25 +164,28 @@ async def get_preview_url(
 async def get_download_url(
     file_id: str,
     current_user: UserResponse = Depends(get_current_user),
+    rbac_cache: dict = Depends(get_rbac_cache),
 ):
     """Get a presigned URL for file download."""
-    # Get file to check directory
-    file_doc = await file_service.get_file(file_id)
-    if not file_doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="File not found",
-        )
-    
-    # Check read permission
-    has_perm = await check_file_permission(
-        current_user, file_doc["directory_id"], PermissionType.READ
-    )
-    if not has_perm:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="No read permission for this file",
+    # Super admin skips the lookup; the service 404s on a missing file
+    if current_user.role != UserRole.SUPER_ADMIN:
+        # Get file directory for the permission check
+        directory_id = await file_service.get_file_dir(file_id)
+        if not directory_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+        
+        # Check read permission
+        has_perm = await check_file_permission(
+            current_user, directory_id, PermissionType.READ, rbac_cache
         )
+        if not has_perm:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="No read permission for this file",
+            )
     
     try:
         return await file_service.get_download_url(file_id)
@@ -176,17 +203,18 @@ async def update_file(
     current_user: UserResponse = Depends(get_current_user),
 ):
     """Update file status (e.g. is_public)."""
-    # Get file to check directory/owner
-    file_doc = await file_service.get_file(file_id)
-    if not file_doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="File not found",
-        )
-    
-    # Check write permission (owner or super_admin)
+    # Check write permission (owner or super_admin).
+    # Super admin skips the lookup; the service 404s on a missing file.
     if current_user.role != UserRole.SUPER_ADMIN:
-        is_owner = await directory_service.is_owner(file_doc["directory_id"], current_user.id)
+        # Get file directory for the ownership check
+        directory_id = await file_service.get_file_dir(file_id)
+        if not directory_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+        
+        is_owner = await directory_service.is_owner(directory_id, current_user.id)
         if not is_owner:
              raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -209,24 +237,34 @@ async def update_file(
 async def delete_file(
     file_id: str,
     current_user: UserResponse = Depends(get_current_user),
+    rbac_cache: dict = Depends(get_rbac_cache),
 ):
     """Delete a file."""
-    # Get file to check directory
-    file_doc = await file_service.get_file(file_id)
-    if not file_doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="File not found",
-        )
-    
-    # Check delete permission (super_admin or owner)
+    # Check delete permission (super_admin or owner).
+    # Super admin skips the lookup; the service 404s on a missing file.
     if current_user.role != UserRole.SUPER_ADMIN:
-        is_owner = await directory_service.is_owner(file_doc["directory_id"], current_user.id)
+        # Get file directory for the permission check
+        directory_id = await file_service.get_file_dir(file_id)
+        if not directory_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+        
+        is_owner = await cached_check(
+            rbac_cache,
+            ("owner", directory_id, current_user.id),
+            lambda: directory_service.is_owner(directory_id, current_user.id),
+        )
         if not is_owner:
-            has_perm = await permission_service.check_permission(
-                user_id=current_user.id,
-                directory_id=file_doc["directory_id"],
-                permission_type=PermissionType.DELETE,
+            has_perm = await cached_check(
+                rbac_cache,
+                ("perm", directory_id, current_user.id, PermissionType.DELETE),
+                lambda: permission_service.check_permission(
+                    user_id=current_user.id,
+                    directory_id=directory_id,
+                    permission_type=PermissionType.DELETE,
+                ),
             )
             if not has_perm:
                 raise HTTPException(
@@ -256,11 +294,12 @@ async def delete_file(
 async def list_files(
     directory_id: str,
     current_user: UserResponse = Depends(get_current_user),
+    rbac_cache: dict = Depends(get_rbac_cache),
 ):
     """List all files in a directory."""
     # Check read permission
     has_perm = await check_file_permission(
-        current_user, directory_id, PermissionType.READ
+        current_user, directory_id, PermissionType.READ, rbac_cache
     )
     if not has_perm:
         raise HTTPException(
@@ -1,8 +1,12 @@
+import logging
+
 from fastapi import APIRouter, HTTPException, status
 from fastapi.responses import RedirectResponse
 
 from app.services.file_service import file_service
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/public/files", tags=["Public"])
 
 
@@ -13,23 +17,15 @@ async def get_public_file_access(file_id: str):
     Redirects to S3 presigned URL.
     No authentication required.
     """
-    # Check if file exists and is public
-    print(f"DEBUG: Requesting public file {file_id}")
-    file_doc = await file_service.get_public_file(file_id)
-    if not file_doc:
-        print(f"DEBUG: File not found or not public: {file_id}")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="File not found or not public",
-        )
-    
-    # Generate presigned download URL (inline for preview)
-    # We use service method which handles S3 interaction
+    # Single lookup: file must exist, be confirmed and public
+    logger.debug("Requesting public file %s", file_id)
     try:
-        download_response = await file_service.get_preview_url(file_id)
-        return RedirectResponse(url=download_response.presigned_url)
+        preview = await file_service.get_public_preview_url(file_id)
     except ValueError as e:
+        logger.debug("File not found or not public: %s", file_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=str(e),
         )
+    
+    return RedirectResponse(url=preview.presigned_url)
@@ -1,8 +1,11 @@
-from typing import List
+import csv
+import io
+from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from app.api.deps import require_admin
-from app.models.user import UserResponse, UserUpdate
+from app.models.user import UserBatchUpdate, UserResponse, UserUpdate
 from app.services.user_service import user_service
 
 
@@ -13,10 +16,55 @@ router = APIRouter(prefix="/users", tags=["users"])
 async def list_users(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
+    after_id: Optional[str] = Query(None, description="Return users after this one; pass the last ID of the previous page"),
     _: UserResponse = Depends(require_admin),
 ):
     """List all users (admin only)."""
-    return await user_service.list_users(skip=skip, limit=limit)
+    # Rows are built from our own documents; skip response_model re-validation
+    users = await user_service.list_users_raw(skip=skip, limit=limit, after_id=after_id)
+    return JSONResponse(content=users)
+
+
+@router.patch("")
+async def batch_update_users(
+    updates: List[UserBatchUpdate],
+    admin: UserResponse = Depends(require_admin),
+):
+    """Update role or status of many users at once (admin only)."""
+    # Prevent admin from deactivating themselves
+    if any(u.user_id == admin.id and u.is_active is False for u in updates):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot deactivate your own account",
+        )
+    
+    updated = await user_service.batch_update_users(updates)
+    return {"message": "Users updated", "updated": updated}
+
+
+@router.get("/export")
+async def export_users(
+    _: UserResponse = Depends(require_admin),
+):
+    """Export all users as CSV, streamed (admin only)."""
+    async def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["id", "email", "role", "is_active", "created_at"])
+        async for user in user_service.iter_users():
+            writer.writerow([user.id, user.email, user.role.value, user.is_active, user.created_at.isoformat()])
+            # Flush in ~64KB chunks rather than per row
+            if buffer.tell() >= 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="users.csv"'},
+    )
 
 
 @router.get("/{user_id}", response_model=UserResponse)
@@ -57,7 +105,13 @@ async def update_user(
                 detail="Only super admin can update email or password",
             )
     
-    user = await user_service.update_user(user_id, update_data)
+    try:
+        user = await user_service.update_user(user_id, update_data)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1,12 +1,19 @@
-from typing import List
+from typing import List, Literal, Optional
 from pydantic_settings import BaseSettings
-from functools import lru_cache
+from functools import cached_property
 
 
 class Settings(BaseSettings):
     # MongoDB
     mongodb_url: str = "mongodb://localhost:27017"
     mongodb_db_name: str = "storageinator"
+    # Wire compression, in order of preference; the server picks the first it supports
+    mongodb_compressors: str = "zstd,zlib"
+    # Skip index creation and startup migrations when the schema is managed out-of-band
+    skip_index_init: bool = False
+
+    # Redis (optional, used for the token blacklist when set)
+    redis_url: Optional[str] = None
 
     # S3/MinIO
     s3_endpoint_url: str = "http://localhost:9000"
@@ -22,6 +29,14 @@ class Settings(BaseSettings):
     access_token_expire_minutes: int = 30
     refresh_token_expire_days: int = 7
 
+    # Passwords. New hashes use password_hasher; existing hashes of the other
+    # kind still verify and are upgraded on the next successful login.
+    # argon2 is opt-in: each hash or verify holds 64 MiB while it runs.
+    password_hasher: Literal["argon2", "bcrypt"] = "bcrypt"
+    # bcrypt cost factor: 10-12 is typical, each step down halves the CPU
+    # spent per login (and per brute-force guess).
+    bcrypt_rounds: int = 12
+
     # App
     allowed_origins: str = "http://localhost:5173,http://localhost:3000"
     max_file_size_mb: int = 100
@@ -31,15 +46,19 @@ class Settings(BaseSettings):
     admin_email: str = "admin@example.com"
     admin_password: str = "changeme123"
 
-    @property
+    @cached_property
     def allowed_origins_list(self) -> List[str]:
         return [origin.strip() for origin in self.allowed_origins.split(",")]
 
-    @property
+    @cached_property
     def allowed_mime_types_list(self) -> List[str]:
         return [mime.strip() for mime in self.allowed_mime_types.split(",")]
 
-    @property
+    @cached_property
+    def mongodb_compressors_list(self) -> List[str]:
+        return [c.strip() for c in self.mongodb_compressors.split(",") if c.strip()]
+
+    @cached_property
     def max_file_size_bytes(self) -> int:
         return self.max_file_size_mb * 1024 * 1024
 
@@ -49,9 +68,4 @@ class Settings(BaseSettings):
         extra = "ignore"
 
 
-@lru_cache()
-def get_settings() -> Settings:
-    return Settings()
-
-
-settings = get_settings()
+settings = Settings()
@@ -0,0 +1,92 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+# Loaders for the current request, by name; None outside a request
+_request_loaders: ContextVar[Optional[Dict[str, "BatchLoader"]]] = ContextVar("request_loaders", default=None)
+
+
+class BatchLoader:
+    """Coalesce loads issued in the same event-loop tick into one batch call, caching results."""
+
+    def __init__(self, batch_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]):
+        self._batch_fn = batch_fn
+        self._cache: Dict[Hashable, asyncio.Future] = {}
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._dispatch_tasks: Set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable) -> Any:
+        """Load one key; missing keys resolve to None."""
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending:
+                # Let every load issued in this tick queue up before dispatching
+                loop.call_soon(self._schedule_dispatch)
+            future = self._cache[key] = self._pending[key] = loop.create_future()
+            future.add_done_callback(_retrieve_exception)
+        return await asyncio.shield(future)
+
+    def clear(self, key: Hashable) -> None:
+        """Forget a cached key so the next load fetches it again."""
+        self._cache.pop(key, None)
+
+    def _schedule_dispatch(self) -> None:
+        # Hold a reference so the task isn't garbage collected mid-flight
+        task = asyncio.ensure_future(self._dispatch())
+        self._dispatch_tasks.add(task)
+        task.add_done_callback(self._dispatch_tasks.discard)
+
+    async def _dispatch(self) -> None:
+        pending, self._pending = self._pending, {}
+        try:
+            results = await self._batch_fn(list(pending))
+        except Exception as e:
+            for key, future in pending.items():
+                self._cache.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    # Awaiters may be cancelled before a failed batch resolves, leaving nobody to
+    # retrieve the exception; mark it retrieved so asyncio doesn't warn
+    if not future.cancelled():
+        future.exception()
+
+
+def get_request_loader(
+    name: str,
+    batch_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+) -> Optional[BatchLoader]:
+    """Get the current request's loader for name, or None outside a request."""
+    loaders = _request_loaders.get()
+    if loaders is None:
+        return None
+
+    loader = loaders.get(name)
+    if loader is None:
+        loader = loaders[name] = BatchLoader(batch_fn)
+    return loader
+
+
+class RequestCacheMiddleware:
+    """ASGI middleware giving each HTTP request fresh loaders."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_loaders.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_loaders.reset(token)
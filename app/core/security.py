@@ -1,75 +1,193 @@
-from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import secrets
+import time
+import bcrypt
+from argon2 import PasswordHasher, extract_parameters
+from argon2.exceptions import InvalidHashError, VerificationError
+from datetime import datetime, timezone
 from typing import Optional, Literal
-from passlib.context import CryptContext
-from jose import jwt, JWTError
+from cachetools import LRUCache, TTLCache
+import jwt
+from jwt.exceptions import InvalidTokenError
 from pydantic import BaseModel
 
 from app.core.config import settings
+from app.models.role import UserRole
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# JWT signing parameters, bound once at import
+_JWT_KEY = settings.jwt_secret_key.encode("utf-8")
+_JWT_ALG = settings.jwt_algorithm
+_JWT_ALGS = [_JWT_ALG]
+
+# argon2id hasher for new password hashes (when password_hasher = "argon2");
+# 64 MiB of memory per hash or verify
+_argon2 = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=1)
+
+# Successfully verified (password, hash) pairs, keyed by an HMAC with the server
+# secret so the cache never holds anything usable as a password oracle
+_verified_password_cache: LRUCache = LRUCache(maxsize=4096)
+
+# Verified token payloads, keyed by token digest (same key as the blacklist cache)
+_decoded_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
 
 
 class TokenPayload(BaseModel):
     sub: str  # user_id
     exp: datetime
     type: Literal["access", "refresh"]
-
-
-def _truncate_password(password: str) -> str:
-    """Truncate password to 72 bytes (bcrypt limit)."""
-    return password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
+    # User claims (access tokens only), valid while ver matches the user's token_version
+    email: Optional[str] = None
+    role: Optional[UserRole] = None
+    created_at: Optional[datetime] = None
+    ver: Optional[int] = None
+
+
+def _verify_bcrypt(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against a bcrypt hash."""
+    # bcrypt only uses the first 72 bytes
+    password = plain_password.encode("utf-8")[:72]
+    hashed = hashed_password.encode("utf-8")
+    try:
+        if bcrypt.checkpw(password, hashed):
+            return True
+        # Older hashes dropped a multi-byte character split at the 72-byte cut
+        legacy = password.decode("utf-8", errors="ignore").encode("utf-8")
+        return legacy != password and bcrypt.checkpw(legacy, hashed)
+    except ValueError:
+        # Malformed or unsupported hash
+        return False
+
+
+def _verify_argon2(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against an argon2 hash."""
+    try:
+        return _argon2.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a plain password against a hashed password."""
-    return pwd_context.verify(_truncate_password(plain_password), hashed_password)
+    """Verify a plain password against a hashed password (argon2 or bcrypt)."""
+    key = hmac.new(
+        _JWT_KEY,
+        plain_password.encode("utf-8") + b"\0" + hashed_password.encode("utf-8"),
+        hashlib.sha256,
+    ).digest()
+    if key in _verified_password_cache:
+        return True
+    
+    if hashed_password.startswith("$argon2"):
+        verified = _verify_argon2(plain_password, hashed_password)
+    else:
+        verified = _verify_bcrypt(plain_password, hashed_password)
+    
+    # Only successes are cached, failed guesses always pay the full KDF cost
+    if verified:
+        _verified_password_cache[key] = True
+    return verified
 
 
 def get_password_hash(password: str) -> str:
-    """Hash a password."""
-    return pwd_context.hash(_truncate_password(password))
+    """Hash a password with the configured hasher."""
+    if settings.password_hasher == "argon2":
+        return _argon2.hash(password)
+    
+    hashed = bcrypt.hashpw(
+        password.encode("utf-8")[:72],
+        bcrypt.gensalt(rounds=settings.bcrypt_rounds),
+    )
+    return hashed.decode("ascii")
+
+
+def hash_parameters(hashed_password: str) -> str:
+    """Scheme and cost part of a hash, without its salt and digest."""
+    # $argon2id$v=19$m=...,t=...,p=...$salt$digest / $2b$12$<salt+digest>
+    parts = 2 if hashed_password.startswith("$argon2") else 1
+    return hashed_password.rsplit("$", parts)[0]
 
 
-def create_access_token(user_id: str) -> str:
+def dummy_password_hash(like: Optional[str] = None) -> str:
+    """Hash a random password with the same scheme and cost as another hash."""
+    password = secrets.token_urlsafe(16)
+    try:
+        if like and like.startswith("$argon2"):
+            return PasswordHasher.from_parameters(extract_parameters(like)).hash(password)
+        if like and like.startswith("$2"):
+            rounds = int(like.split("$")[2])
+            return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("ascii")
+    except (InvalidHashError, IndexError, ValueError):
+        pass
+    return get_password_hash(password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check if a hash was made with another hasher or outdated parameters."""
+    if settings.password_hasher == "argon2":
+        if not hashed_password.startswith("$argon2"):
+            return True
+        return _argon2.check_needs_rehash(hashed_password)
+    
+    if not hashed_password.startswith("$2"):
+        return True
+    # bcrypt hashes look like $2b$12$..., the cost sits in the third field
+    try:
+        return int(hashed_password.split("$")[2]) != settings.bcrypt_rounds
+    except (IndexError, ValueError):
+        return True
+
+
+def create_access_token(user_id: str, claims: Optional[dict] = None) -> str:
     """Create a new access token."""
-    expire = datetime.now(timezone.utc) + timedelta(
-        minutes=settings.access_token_expire_minutes
-    )
+    now = int(time.time())
     payload = {
+        **(claims or {}),
         "sub": user_id,
-        "exp": expire,
+        "exp": now + settings.access_token_expire_minutes * 60,
         "type": "access",
     }
-    return jwt.encode(payload, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
+    return jwt.encode(payload, _JWT_KEY, algorithm=_JWT_ALG)
 
 
 def create_refresh_token(user_id: str) -> str:
     """Create a new refresh token."""
-    expire = datetime.now(timezone.utc) + timedelta(
-        days=settings.refresh_token_expire_days
-    )
+    now = int(time.time())
     payload = {
         "sub": user_id,
-        "exp": expire,
+        "exp": now + settings.refresh_token_expire_days * 86400,
         "type": "refresh",
     }
-    return jwt.encode(payload, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
+    return jwt.encode(payload, _JWT_KEY, algorithm=_JWT_ALG)
 
 
 def decode_token(token: str) -> Optional[TokenPayload]:
     """Decode and validate a JWT token."""
+    key = hash_token(token)
+    cached = _decoded_token_cache.get(key)
+    if cached is not None:
+        if cached.exp > datetime.now(timezone.utc):
+            return cached
+        _decoded_token_cache.pop(key, None)
+        return None
+    
     try:
-        payload = jwt.decode(
-            token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm]
-        )
-        return TokenPayload(**payload)
-    except JWTError:
+        payload = jwt.decode(token, _JWT_KEY, algorithms=_JWT_ALGS)
+        token_payload = TokenPayload(**payload)
+    except InvalidTokenError:
         return None
+    
+    _decoded_token_cache[key] = token_payload
+    return token_payload
+
+
+def hash_token(token: str) -> bytes:
+    """Hash a token for use as a lookup key instead of the raw JWT."""
+    return hashlib.sha256(token.encode("utf-8")).digest()
 
 
-def create_tokens(user_id: str) -> tuple[str, str]:
+def create_tokens(user_id: str, claims: Optional[dict] = None) -> tuple[str, str]:
     """Create both access and refresh tokens."""
-    access_token = create_access_token(user_id)
+    access_token = create_access_token(user_id, claims)
     refresh_token = create_refresh_token(user_id)
     return access_token, refresh_token
@@ -0,0 +1,114 @@
+"""One-off data migrations, run explicitly: python -m app.db.migrations"""
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+from app.core.config import settings
+from app.db.mongodb import mongodb, get_directories_collection, migrate_token_blacklist
+from app.models.role import UserRole
+from app.services.directory_service import directory_service
+
+# Unique (owner_id, path) index; named apart from the old non-unique one so both can coexist
+DIRECTORY_PATH_INDEX = "owner_id_1_path_1_unique"
+
+# Indexes replaced by DIRECTORY_PATH_INDEX
+_OLD_DIRECTORY_INDEXES = ("owner_id_1_path_1", "owner_id_1")
+
+
+async def _find_duplicate_paths() -> list:
+    """Get the shallowest groups of directories sharing an (owner_id, path), oldest first."""
+    directories = get_directories_collection()
+    groups = await directories.aggregate([
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$group": {
+            "_id": {"owner_id": "$owner_id", "path": "$path"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True).to_list(length=None)
+    if not groups:
+        return []
+    
+    # Renaming a directory moves its subtree, which may resolve deeper duplicates
+    depth = min(g["_id"]["path"].count("/") for g in groups)
+    return [g for g in groups if g["_id"]["path"].count("/") == depth]
+
+
+async def dedupe_directory_paths() -> int:
+    """Rename directories that duplicate an (owner_id, path), keeping the oldest; returns how many."""
+    directories = get_directories_collection()
+    renamed = 0
+    
+    while groups := await _find_duplicate_paths():
+        for group in groups:
+            for directory_id in group["ids"][1:]:
+                dir_doc = await directories.find_one({"_id": directory_id}, {"name": 1, "path": 1})
+                base_path = dir_doc["path"][:-len(dir_doc["name"])]
+                
+                # First free "name (n)" at the same location
+                n = 2
+                while await directories.find_one(
+                    {"owner_id": group["_id"]["owner_id"], "path": f"{base_path}{dir_doc['name']} ({n})"},
+                    {"_id": 1},
+                ):
+                    n += 1
+                
+                await directory_service.update_directory(
+                    directory_id,
+                    group["_id"]["owner_id"],
+                    UserRole.SUPER_ADMIN,
+                    name=f"{dir_doc['name']} ({n})",
+                )
+                print(f"Renamed duplicate directory {directory_id}: {dir_doc['path']} -> {base_path}{dir_doc['name']} ({n})")
+                renamed += 1
+    
+    return renamed
+
+
+async def migrate_directory_path_index():
+    """Dedupe directory paths, then replace the non-unique (owner_id, path) index with a unique one."""
+    directories = get_directories_collection()
+    
+    renamed = await dedupe_directory_paths()
+    print(f"Renamed {renamed} duplicate directories")
+    
+    # Build the new index before dropping the old one, so lookups stay indexed throughout
+    try:
+        await directories.create_index(
+            [("owner_id", 1), ("path", 1)], unique=True, name=DIRECTORY_PATH_INDEX,
+        )
+    except OperationFailure as e:
+        # Servers that refuse two indexes on one key pattern: swap them instead
+        if e.code not in (85, 86):
+            raise
+        await directories.drop_index("owner_id_1_path_1")
+        await directories.create_index(
+            [("owner_id", 1), ("path", 1)], unique=True, name=DIRECTORY_PATH_INDEX,
+        )
+    
+    existing = await directories.index_information()
+    for index_name in _OLD_DIRECTORY_INDEXES:
+        if index_name in existing:
+            await directories.drop_index(index_name)
+            print(f"Dropped index directories.{index_name}")
+
+
+async def main():
+    """Connect and run the migrations."""
+    mongodb.client = AsyncIOMotorClient(
+        settings.mongodb_url,
+        compressors=settings.mongodb_compressors_list,
+    )
+    mongodb.db = mongodb.client[settings.mongodb_db_name]
+    mongodb.collections = {}
+    try:
+        await migrate_token_blacklist()
+        await migrate_directory_path_index()
+    finally:
+        mongodb.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
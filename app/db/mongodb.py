@@ -1,12 +1,22 @@
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-from typing import Optional
+import asyncio
+from datetime import datetime, timezone
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import IndexModel
+from pymongo.errors import BulkWriteError, OperationFailure
+from typing import Dict, Optional
 
 from app.core.config import settings
+from app.core.security import hash_token
 
 
 class MongoDB:
     client: Optional[AsyncIOMotorClient] = None
     db: Optional[AsyncIOMotorDatabase] = None
+    # Collection handles by name, built once per connection
+    collections: Dict[str, AsyncIOMotorCollection] = {}
+    # Whether a unique (owner_id, path) index guards against duplicate directories
+    unique_directory_paths: bool = False
 
 
 mongodb = MongoDB()
@@ -14,11 +24,19 @@ mongodb = MongoDB()
 
 async def connect_to_mongodb():
     """Connect to MongoDB."""
-    mongodb.client = AsyncIOMotorClient(settings.mongodb_url)
+    mongodb.client = AsyncIOMotorClient(
+        settings.mongodb_url,
+        compressors=settings.mongodb_compressors_list,
+    )
     mongodb.db = mongodb.client[settings.mongodb_db_name]
+    mongodb.collections = {}
     
-    # Create indexes
-    await create_indexes()
+    # Create indexes and run pending startup migrations (skipped when the schema is managed out-of-band)
+    if not settings.skip_index_init:
+        await create_indexes()
+        await migrate_token_blacklist()
+    await check_blacklist_ttl_index()
+    await check_directory_path_index()
     
     print(f"Connected to MongoDB: {settings.mongodb_db_name}")
 
@@ -27,34 +45,167 @@ async def close_mongodb_connection():
     """Close MongoDB connection."""
     if mongodb.client:
         mongodb.client.close()
+        mongodb.collections = {}
         print("Closed MongoDB connection")
 
 
+# Index definitions per collection
+INDEXES = {
+    "users": [
+        IndexModel("email", unique=True),
+        # Serves ordered and keyset-paginated user listings
+        IndexModel([("created_at", 1), ("_id", 1)]),
+    ],
+    "directories": [
+        # Also serves plain owner_id lookups; unique so concurrent creates can't duplicate a path.
+        # Deployments with the older non-unique index get it via python -m app.db.migrations.
+        IndexModel([("owner_id", 1), ("path", 1)], unique=True, name="owner_id_1_path_1_unique"),
+        IndexModel("parent_id"),
+        IndexModel("is_public"),
+    ],
+    "files": [
+        # Serves directory listings (directory_id + confirmed) and plain directory_id lookups
+        IndexModel([("directory_id", 1), ("confirmed", 1)]),
+        IndexModel("owner_id"),
+        IndexModel("s3_key", unique=True),
+    ],
+    "permissions": [
+        IndexModel([("user_id", 1), ("directory_id", 1)], unique=True),
+        IndexModel("directory_id"),
+    ],
+    # Entries are keyed by the binary token digest in _id
+    "token_blacklist": [
+        IndexModel("expires_at", expireAfterSeconds=0),
+    ],
+}
+
+
 async def create_indexes():
-    """Create database indexes."""
+    """Create database indexes, one request per collection, all collections concurrently."""
     if mongodb.db is None:
         return
     
-    # Users collection indexes
-    await mongodb.db.users.create_index("email", unique=True)
+    await asyncio.gather(*(
+        _create_collection_indexes(name, models)
+        for name, models in INDEXES.items()
+    ))
+
+
+async def _create_collection_indexes(name: str, models: list):
+    """Create a collection's indexes, warning about (never dropping) ones that conflict."""
+    collection = mongodb.db[name]
+    try:
+        await collection.create_indexes(models)
+        return
+    except OperationFailure as e:
+        # IndexOptionsConflict / IndexKeySpecsConflict / DuplicateKey: an older definition
+        # or data that needs a migration first
+        if e.code not in (85, 86, 11000):
+            raise
     
-    # Directories collection indexes
-    await mongodb.db.directories.create_index("owner_id")
-    await mongodb.db.directories.create_index("parent_id")
-    await mongodb.db.directories.create_index([("owner_id", 1), ("path", 1)])
+    # One failing index fails the whole batch; create the rest one by one
+    for model in models:
+        try:
+            await collection.create_indexes([model])
+        except OperationFailure as e:
+            if e.code not in (85, 86, 11000):
+                raise
+            print(
+                f"WARNING: could not create index {name}.{model.document['name']} "
+                f"({e.details.get('errmsg', e) if e.details else e}); run python -m app.db.migrations"
+            )
+
+
+async def check_blacklist_ttl_index():
+    """Warn if the token blacklist has no TTL index (entries would never be purged)."""
+    if mongodb.db is None:
+        return
     
-    # Files collection indexes
-    await mongodb.db.files.create_index("directory_id")
-    await mongodb.db.files.create_index("owner_id")
-    await mongodb.db.files.create_index("s3_key", unique=True)
+    info = await mongodb.db.token_blacklist.index_information()
+    for spec in info.values():
+        if list(dict(spec["key"])) == ["expires_at"] and spec.get("expireAfterSeconds") == 0:
+            return
+    print("WARNING: token_blacklist has no TTL index on expires_at, blacklist will grow unbounded")
+
+
+async def migration_applied(name: str) -> bool:
+    """Check whether a one-time migration has already run."""
+    return await mongodb.db.migrations.find_one({"_id": name}, {"_id": 1}) is not None
+
+
+async def mark_migration_applied(name: str):
+    """Record that a one-time migration has run."""
+    await mongodb.db.migrations.update_one(
+        {"_id": name},
+        {"$setOnInsert": {"applied_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+async def check_directory_path_index():
+    """Record whether directory paths are unique by index; warn (services check by query) if not."""
+    if mongodb.db is None:
+        return
+    
+    info = await mongodb.db.directories.index_information()
+    mongodb.unique_directory_paths = any(
+        list(dict(spec["key"])) == ["owner_id", "path"] and spec.get("unique")
+        for spec in info.values()
+    )
+    if not mongodb.unique_directory_paths:
+        print("WARNING: directories has no unique (owner_id, path) index, run python -m app.db.migrations")
+
+
+async def migrate_token_blacklist(batch_size: int = 1000):
+    """Re-key legacy blacklist entries (raw token or hex digest) by binary digest, once."""
+    if mongodb.db is None or await migration_applied("token_blacklist_digest_keys"):
+        return
+    
+    blacklist = mongodb.db.token_blacklist
     
-    # Permissions collection indexes
-    await mongodb.db.permissions.create_index([("user_id", 1), ("directory_id", 1)], unique=True)
-    await mongodb.db.permissions.create_index("directory_id")
+    # The old unique index on the raw token would reject digest-keyed entries
+    try:
+        await blacklist.drop_index("token_1")
+    except OperationFailure:
+        pass
     
-    # Token blacklist indexes
-    await mongodb.db.token_blacklist.create_index("token", unique=True)
-    await mongodb.db.token_blacklist.create_index("expires_at", expireAfterSeconds=0)
+    # Migrated entries are removed, so each pass picks up the next batch
+    migrated = 0
+    while legacy := await blacklist.find({
+        "$or": [{"token": {"$exists": True}}, {"_id": {"$type": "string"}}],
+    }).limit(batch_size).to_list(length=batch_size):
+        try:
+            await blacklist.insert_many(
+                [
+                    {
+                        "_id": hash_token(d["token"]) if "token" in d else bytes.fromhex(d["_id"]),
+                        "expires_at": d["expires_at"],
+                    }
+                    for d in legacy
+                ],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            # Duplicate keys were already migrated by another instance; any other
+            # error leaves the batch in place rather than losing entries
+            if e.details.get("writeConcernErrors") or any(
+                err.get("code") != 11000 for err in e.details.get("writeErrors", [])
+            ):
+                raise
+        # Every entry of the batch is now written or already existed
+        await blacklist.delete_many({"_id": {"$in": [d["_id"] for d in legacy]}})
+        migrated += len(legacy)
+    
+    await mark_migration_applied("token_blacklist_digest_keys")
+    if migrated:
+        print(f"Migrated {migrated} token blacklist entries")
+
+
+def id_filter(id_: str) -> dict:
+    """Match an _id stored as ObjectId or in its legacy string form."""
+    if ObjectId.is_valid(id_):
+        return {"_id": {"$in": [ObjectId(id_), id_]}}
+    return {"_id": id_}
 
 
 def get_database() -> AsyncIOMotorDatabase:
@@ -64,22 +215,30 @@ def get_database() -> AsyncIOMotorDatabase:
     return mongodb.db
 
 
+def _get_collection(name: str) -> AsyncIOMotorCollection:
+    """Get a collection handle, reusing the one built earlier on this connection."""
+    collection = mongodb.collections.get(name)
+    if collection is None:
+        collection = mongodb.collections[name] = get_database()[name]
+    return collection
+
+
 # Collection getters
 def get_users_collection():
-    return get_database().users
+    return _get_collection("users")
 
 
 def get_directories_collection():
-    return get_database().directories
+    return _get_collection("directories")
 
 
 def get_files_collection():
-    return get_database().files
+    return _get_collection("files")
 
 
 def get_permissions_collection():
-    return get_database().permissions
+    return _get_collection("permissions")
 
 
 def get_token_blacklist_collection():
-    return get_database().token_blacklist
+    return _get_collection("token_blacklist")
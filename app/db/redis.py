@@ -0,0 +1,34 @@
+from redis.asyncio import Redis
+from typing import Optional
+
+from app.core.config import settings
+
+
+class RedisDB:
+    client: Optional[Redis] = None
+
+
+redis_db = RedisDB()
+
+
+async def connect_to_redis():
+    """Connect to Redis if configured."""
+    if not settings.redis_url:
+        return
+
+    redis_db.client = Redis.from_url(settings.redis_url)
+    await redis_db.client.ping()
+
+    print("Connected to Redis")
+
+
+async def close_redis_connection():
+    """Close Redis connection."""
+    if redis_db.client:
+        await redis_db.client.aclose()
+        print("Closed Redis connection")
+
+
+def get_redis() -> Optional[Redis]:
+    """Get Redis client, or None when Redis is not configured."""
+    return redis_db.client
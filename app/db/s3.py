@@ -1,22 +1,48 @@
-import boto3
+import aioboto3
 from botocore.exceptions import ClientError
-from typing import Optional
+from cachetools import TTLCache
+from contextlib import AsyncExitStack
+from typing import List, Optional
 
 from app.core.config import settings
 
+# Presigned GET URLs are cached this long and signed for expires_in + this, so a
+# cached URL is always valid for at least the requested expires_in
+PRESIGN_CACHE_TTL = 300
+
 
 class S3Client:
     def __init__(self):
-        self.client = boto3.client(
-            "s3",
-            endpoint_url=settings.s3_endpoint_url,
-            aws_access_key_id=settings.s3_access_key,
-            aws_secret_access_key=settings.s3_secret_key,
-            region_name=settings.s3_region,
-        )
+        self.session = aioboto3.Session()
+        self.client = None
+        self._exit_stack: Optional[AsyncExitStack] = None
         self.bucket_name = settings.s3_bucket_name
         self.public_url = settings.s3_public_url
         self.internal_url = settings.s3_endpoint_url
+        # Static part of every presign request; callers copy and extend it
+        self._object_params = {"Bucket": self.bucket_name}
+        # Object key -> {(filename, content_disposition, expires_in): presigned GET URL}
+        self._presigned_get_cache: TTLCache = TTLCache(maxsize=10000, ttl=PRESIGN_CACHE_TTL)
+
+    async def connect(self):
+        """Open the S3 client (held for the application lifetime)."""
+        self._exit_stack = AsyncExitStack()
+        self.client = await self._exit_stack.enter_async_context(
+            self.session.client(
+                "s3",
+                endpoint_url=settings.s3_endpoint_url,
+                aws_access_key_id=settings.s3_access_key,
+                aws_secret_access_key=settings.s3_secret_key,
+                region_name=settings.s3_region,
+            )
+        )
+
+    async def close(self):
+        """Close the S3 client."""
+        if self._exit_stack:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self.client = None
 
     def _make_public_url(self, url: str) -> str:
         """Replace internal URL with public URL for browser access."""
@@ -25,63 +51,69 @@ class S3Client:
     async def ensure_bucket_exists(self):
         """Create bucket if it doesn't exist."""
         try:
-            self.client.head_bucket(Bucket=self.bucket_name)
+            await self.client.head_bucket(Bucket=self.bucket_name)
         except ClientError:
-            self.client.create_bucket(Bucket=self.bucket_name)
+            await self.client.create_bucket(Bucket=self.bucket_name)
             print(f"Created S3 bucket: {self.bucket_name}")
 
-    def generate_presigned_put_url(
+    async def generate_presigned_put_url(
         self,
         key: str,
         content_type: str,
         expires_in: int = 3600,
     ) -> str:
         """Generate a presigned URL for uploading a file."""
-        url = self.client.generate_presigned_url(
+        url = await self.client.generate_presigned_url(
             "put_object",
-            Params={
-                "Bucket": self.bucket_name,
-                "Key": key,
-                "ContentType": content_type,
-            },
+            Params={**self._object_params, "Key": key, "ContentType": content_type},
             ExpiresIn=expires_in,
         )
         return self._make_public_url(url)
 
-    def generate_presigned_get_url(
+    async def generate_presigned_get_url(
         self,
         key: str,
         expires_in: int = 3600,
         filename: Optional[str] = None,
         content_disposition: str = "attachment",
     ) -> str:
-        """Generate a presigned URL for downloading a file."""
-        params = {
-            "Bucket": self.bucket_name,
-            "Key": key,
-        }
+        """Generate a presigned URL for downloading a file, reusing a recent one."""
+        cache_key = (filename, content_disposition, expires_in)
+        urls = self._presigned_get_cache.get(key)
+        if urls is None:
+            urls = self._presigned_get_cache[key] = {}
+        elif cache_key in urls:
+            return urls[cache_key]
+
+        params = {**self._object_params, "Key": key}
         if filename:
             params["ResponseContentDisposition"] = f'{content_disposition}; filename="{filename}"'
-        
-        url = self.client.generate_presigned_url(
+
+        url = await self.client.generate_presigned_url(
             "get_object",
             Params=params,
-            ExpiresIn=expires_in,
+            ExpiresIn=expires_in + PRESIGN_CACHE_TTL,
         )
-        return self._make_public_url(url)
+        url = self._make_public_url(url)
+        urls[cache_key] = url
+        return url
+
+    def invalidate_presigned_get_urls(self, key: str) -> None:
+        """Forget cached presigned GET URLs for an object, e.g. once it is deleted."""
+        self._presigned_get_cache.pop(key, None)
 
-    def check_object_exists(self, key: str) -> bool:
+    async def check_object_exists(self, key: str) -> bool:
         """Check if an object exists in S3."""
         try:
-            self.client.head_object(Bucket=self.bucket_name, Key=key)
+            await self.client.head_object(Bucket=self.bucket_name, Key=key)
             return True
         except ClientError:
             return False
 
-    def get_object_metadata(self, key: str) -> Optional[dict]:
+    async def get_object_metadata(self, key: str) -> Optional[dict]:
         """Get object metadata from S3."""
         try:
-            response = self.client.head_object(Bucket=self.bucket_name, Key=key)
+            response = await self.client.head_object(Bucket=self.bucket_name, Key=key)
             return {
                 "content_length": response.get("ContentLength"),
                 "content_type": response.get("ContentType"),
@@ -90,19 +122,50 @@ class S3Client:
         except ClientError:
             return None
 
-    def delete_object(self, key: str) -> bool:
+    async def delete_object(self, key: str) -> bool:
         """Delete an object from S3."""
         try:
-            self.client.delete_object(Bucket=self.bucket_name, Key=key)
+            await self.client.delete_object(Bucket=self.bucket_name, Key=key)
             return True
         except ClientError:
             return False
 
+    async def delete_objects(self, keys: List[str]) -> List[str]:
+        """Delete many objects from S3, up to 1000 per request; returns the keys that failed."""
+        failed = []
+        for i in range(0, len(keys), 1000):
+            batch = keys[i:i + 1000]
+            try:
+                response = await self.client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        "Objects": [{"Key": key} for key in batch],
+                        "Quiet": True,
+                    },
+                )
+            except ClientError:
+                failed.extend(batch)
+                continue
+            # Quiet mode lists only the keys that could not be deleted
+            failed.extend(error["Key"] for error in response.get("Errors", []))
+        return failed
+
 
 # Singleton instance
 s3_client = S3Client()
 
 
+async def connect_to_s3():
+    """Open the S3 client and make sure the bucket exists."""
+    await s3_client.connect()
+    await s3_client.ensure_bucket_exists()
+
+
+async def close_s3_connection():
+    """Close the S3 client."""
+    await s3_client.close()
+
+
 def get_s3_client() -> S3Client:
     """Get S3 client instance."""
     return s3_client
@@ -3,8 +3,10 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
+from app.core.request_cache import RequestCacheMiddleware
 from app.db.mongodb import connect_to_mongodb, close_mongodb_connection
-from app.db.s3 import s3_client
+from app.db.redis import connect_to_redis, close_redis_connection
+from app.db.s3 import connect_to_s3, close_s3_connection
 from app.api import auth, directories, files, permissions, public, users
 from app.services.auth_service import auth_service
 
@@ -14,7 +16,9 @@ async def lifespan(app: FastAPI):
     """Application lifespan events."""
     # Startup
     await connect_to_mongodb()
-    await s3_client.ensure_bucket_exists()
+    await connect_to_redis()
+    await auth_service.migrate_blacklist_to_redis()
+    await connect_to_s3()
     
     # Create admin user if not exists
     await auth_service.create_admin_user(
@@ -27,6 +31,8 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    await close_s3_connection()
+    await close_redis_connection()
     await close_mongodb_connection()
     print("Application stopped")
 
@@ -47,6 +53,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request directory cache
+app.add_middleware(RequestCacheMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api")
 app.include_router(directories.router, prefix="/api")
@@ -22,6 +22,7 @@ class DirectoryInDB(BaseModel):
     name: str
     owner_id: str
     parent_id: Optional[str] = None
+    parent_path: Optional[str] = None  # Parent's path, "" for root directories
     path: str  # Full path like /root/folder1/folder2
     is_public: bool = False
     created_at: datetime
@@ -1,4 +1,5 @@
-from enum import Enum
+from enum import Enum, IntFlag
+from typing import Union
 
 
 class UserRole(str, Enum):
@@ -8,6 +9,10 @@ class UserRole(str, Enum):
     PENDING = "pending"
 
 
+# Roles with access to admin endpoints
+ADMIN_ROLES = frozenset({UserRole.ADMIN, UserRole.SUPER_ADMIN})
+
+
 # Role permissions mapping
 ROLE_PERMISSIONS = {
     UserRole.SUPER_ADMIN: {
@@ -46,10 +51,32 @@ def get_role_permissions(role: UserRole) -> dict:
     return ROLE_PERMISSIONS.get(role, ROLE_PERMISSIONS[UserRole.USER])
 
 
-def has_permission(role: UserRole, permission: str) -> bool:
+class RolePermission(IntFlag):
+    """Role permissions as bit flags."""
+    READ = 1
+    WRITE = 2
+    DELETE = 4
+    MANAGE_USERS = 8
+    ACCESS_ALL = 16
+
+
+# Precomputed role -> permission bitmask, derived from ROLE_PERMISSIONS
+ROLE_PERMISSION_MASKS = {
+    role: RolePermission(sum(
+        RolePermission[name.upper()] for name, granted in permissions.items() if granted
+    ))
+    for role, permissions in ROLE_PERMISSIONS.items()
+}
+
+
+def has_permission(role: UserRole, permission: Union[str, RolePermission]) -> bool:
     """Check if a role has a specific permission."""
-    permissions = get_role_permissions(role)
-    return permissions.get(permission, False)
+    if isinstance(permission, str):
+        permission = RolePermission.__members__.get(permission.upper())
+        if permission is None:
+            return False
+    mask = ROLE_PERMISSION_MASKS.get(role, ROLE_PERMISSION_MASKS[UserRole.USER])
+    return bool(mask & permission)
 
 
 def is_super_admin(role: UserRole) -> bool:
@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional
-from pydantic import BaseModel, EmailStr, Field
+from bson import ObjectId
+from pydantic import BaseModel, EmailStr, Field, field_validator
 
 from app.models.role import UserRole
 
@@ -29,6 +30,11 @@ class UserInDB(BaseModel):
     class Config:
         populate_by_name = True
 
+    @field_validator("id", mode="before")
+    @classmethod
+    def _stringify_id(cls, value):
+        return str(value) if isinstance(value, ObjectId) else value
+
 
 class UserResponse(BaseModel):
     """User response schema (public data)."""
@@ -48,3 +54,13 @@ class UserUpdate(BaseModel):
     is_active: Optional[bool] = None
     email: Optional[EmailStr] = None
     password: Optional[str] = Field(None, min_length=6, max_length=100)
+
+
+class UserBatchUpdate(BaseModel):
+    """Schema for one entry of a bulk user update (admin only).
+
+    Email and password changes go through the single-user update.
+    """
+    user_id: str
+    role: Optional[UserRole] = None
+    is_active: Optional[bool] = None
@@ -1,18 +1,106 @@
+import asyncio
+import logging
+from collections import Counter
 from datetime import datetime, timezone
 from typing import Optional
 from bson import ObjectId
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError
 
-from app.db.mongodb import get_users_collection, get_token_blacklist_collection
+from app.db.mongodb import (
+    get_users_collection,
+    get_token_blacklist_collection,
+    id_filter,
+    migration_applied,
+    mark_migration_applied,
+)
+from app.db.redis import get_redis
 from app.core.security import (
     get_password_hash,
+    dummy_password_hash,
+    hash_parameters,
     verify_password,
+    password_needs_rehash,
     create_tokens,
     decode_token,
+    hash_token,
+    TokenPayload,
 )
 from app.models.user import UserCreate, UserResponse
 from app.models.auth import Token
 from app.models.role import UserRole
 
+logger = logging.getLogger(__name__)
+
+
+# Blacklist lookups keyed by token digest -> revoked flag.
+# Spares a MongoDB round-trip on repeat requests with the same token.
+_blacklist_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+
+
+# User fields needed to issue tokens (status checks + access token claims)
+_TOKEN_USER_PROJECTION = {
+    "email": 1,
+    "role": 1,
+    "is_active": 1,
+    "created_at": 1,
+    "token_version": 1,
+}
+_LOGIN_USER_PROJECTION = {**_TOKEN_USER_PROJECTION, "hashed_password": 1}
+
+# Hash verified against when the email is unknown; its password is never revealed.
+# Refreshed so it follows stored hashes as they are rehashed to new parameters.
+_dummy_hash_cache: TTLCache = TTLCache(maxsize=1, ttl=3600)
+
+# Stored hashes sampled to pick the dummy hash's scheme and cost
+_DUMMY_HASH_SAMPLE_SIZE = 100
+
+# User ID -> token_version, so claims in access tokens can be trusted without
+# loading the user. Bumped versions are picked up within the TTL.
+_token_version_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+
+
+def _user_claims(user: dict) -> dict:
+    """Access token claims for a user document."""
+    return {
+        "email": user["email"],
+        "role": user.get("role", UserRole.USER.value),
+        "created_at": user["created_at"].isoformat(),
+        "ver": user.get("token_version", 0),
+    }
+
+
+async def _get_dummy_hash() -> str:
+    """Dummy hash with the scheme and cost of most stored password hashes."""
+    dummy = _dummy_hash_cache.get("dummy")
+    if dummy is not None:
+        return dummy
+    
+    sample = await get_users_collection().aggregate([
+        {"$sample": {"size": _DUMMY_HASH_SAMPLE_SIZE}},
+        {"$project": {"_id": 0, "hashed_password": 1}},
+    ]).to_list(length=_DUMMY_HASH_SAMPLE_SIZE)
+    hashes = [u["hashed_password"] for u in sample if u.get("hashed_password")]
+    
+    like = None
+    if hashes:
+        common = Counter(hash_parameters(h) for h in hashes).most_common(1)[0][0]
+        like = next(h for h in hashes if hash_parameters(h) == common)
+    
+    dummy = await asyncio.to_thread(dummy_password_hash, like)
+    _dummy_hash_cache["dummy"] = dummy
+    return dummy
+
+
+def _blacklist_id(token: str) -> bytes:
+    """Blacklist entry ID: raw 32-byte SHA-256 digest of the token."""
+    return hash_token(token)
+
+
+def _blacklist_key(entry_id: bytes) -> str:
+    """Redis key for a blacklist entry."""
+    return f"blacklist:{entry_id.hex()[:32]}"
+
 
 class AuthService:
     """Service for authentication operations."""
@@ -22,25 +110,27 @@ class AuthService:
         """Register a new user."""
         users = get_users_collection()
         
-        # Check if user already exists
-        existing = await users.find_one({"email": user_data.email})
-        if existing:
-            raise ValueError("User with this email already exists")
+        # Hash off the event loop, bcrypt is deliberately slow
+        hashed_password = await asyncio.to_thread(get_password_hash, user_data.password)
         
         # Create user document
         user_doc = {
-            "_id": str(ObjectId()),
+            "_id": ObjectId(),
             "email": user_data.email,
-            "hashed_password": get_password_hash(user_data.password),
+            "hashed_password": hashed_password,
             "role": role.value,
             "is_active": True,
             "created_at": datetime.now(timezone.utc),
         }
         
-        await users.insert_one(user_doc)
+        # The unique email index rejects an already registered email
+        try:
+            await users.insert_one(user_doc)
+        except DuplicateKeyError:
+            raise ValueError("User with this email already exists")
         
         return UserResponse(
-            id=user_doc["_id"],
+            id=str(user_doc["_id"]),
             email=user_doc["email"],
             role=role,
             is_active=True,
@@ -52,8 +142,14 @@ class AuthService:
         """Authenticate user and return tokens."""
         users = get_users_collection()
         
-        user = await users.find_one({"email": email})
+        user = await users.find_one({"email": email}, _LOGIN_USER_PROJECTION)
         if not user:
+            # Spend the same hashing time as for a real user, so response
+            # timing doesn't reveal which emails are registered
+            await asyncio.to_thread(verify_password, password, await _get_dummy_hash())
+            return None
+        
+        if not await asyncio.to_thread(verify_password, password, user["hashed_password"]):
             return None
         
         # Check if user is active
@@ -64,10 +160,15 @@ class AuthService:
         if user.get("role") == UserRole.PENDING:
             return None
         
-        if not verify_password(password, user["hashed_password"]):
-            return None
+        # Upgrade hashes made with another hasher or outdated parameters
+        if password_needs_rehash(user["hashed_password"]):
+            new_hash = await asyncio.to_thread(get_password_hash, password)
+            await users.update_one(
+                {"_id": user["_id"], "hashed_password": user["hashed_password"]},
+                {"$set": {"hashed_password": new_hash}},
+            )
         
-        access_token, refresh_token = create_tokens(user["_id"])
+        access_token, refresh_token = create_tokens(str(user["_id"]), _user_claims(user))
         
         return Token(
             access_token=access_token,
@@ -77,30 +178,25 @@ class AuthService:
     @staticmethod
     async def refresh_access_token(refresh_token: str) -> Optional[Token]:
         """Refresh access token using refresh token."""
-        # Check if token is blacklisted
-        blacklist = get_token_blacklist_collection()
-        if await blacklist.find_one({"token": refresh_token}):
-            return None
-        
-        # Decode and validate refresh token
+        # Decode and validate refresh token (no I/O for malformed tokens)
         payload = decode_token(refresh_token)
         if not payload or payload.type != "refresh":
             return None
         
+        # Blacklist the refresh token atomically; if it was already there the
+        # token has been used (or revoked). One write instead of read + write,
+        # and concurrent refreshes with the same token can't both succeed.
+        if not await AuthService._claim_for_blacklist(refresh_token, payload.exp):
+            return None
+        
         # Check if user still exists and is active
         users = get_users_collection()
-        user = await users.find_one({"_id": payload.sub})
+        user = await users.find_one(id_filter(payload.sub), _TOKEN_USER_PROJECTION)
         if not user or not user.get("is_active", True):
             return None
         
         # Create new tokens
-        access_token, new_refresh_token = create_tokens(payload.sub)
-        
-        # Blacklist old refresh token
-        await blacklist.insert_one({
-            "token": refresh_token,
-            "expires_at": payload.exp,
-        })
+        access_token, new_refresh_token = create_tokens(payload.sub, _user_claims(user))
         
         return Token(
             access_token=access_token,
@@ -114,27 +210,109 @@ class AuthService:
         if not payload:
             return False
         
-        blacklist = get_token_blacklist_collection()
         try:
-            await blacklist.insert_one({
-                "token": token,
-                "expires_at": payload.exp,
-            })
+            await AuthService._add_to_blacklist(token, payload.exp)
+            _blacklist_cache[hash_token(token)] = True
             return True
         except Exception:
             return False
 
+    @staticmethod
+    async def is_token_blacklisted(token: str) -> bool:
+        """Check if token has been revoked."""
+        key = hash_token(token)
+        revoked = _blacklist_cache.get(key)
+        if revoked is None:
+            revoked = await AuthService._find_blacklisted(token)
+            _blacklist_cache[key] = revoked
+        return revoked
+
+    @staticmethod
+    async def _find_blacklisted(token: str) -> bool:
+        """Look up token in the blacklist store (Redis if configured, else MongoDB)."""
+        entry_id = _blacklist_id(token)
+        redis = get_redis()
+        if redis is not None:
+            return await redis.exists(_blacklist_key(entry_id)) > 0
+        
+        blacklist = get_token_blacklist_collection()
+        return await blacklist.find_one({"_id": entry_id}, {"_id": 1}) is not None
+
+    @staticmethod
+    async def _add_to_blacklist(token: str, expires_at: datetime) -> None:
+        """Add token to the blacklist store until it expires."""
+        entry_id = _blacklist_id(token)
+        redis = get_redis()
+        if redis is not None:
+            ttl = int((expires_at - datetime.now(timezone.utc)).total_seconds())
+            if ttl > 0:
+                await redis.set(_blacklist_key(entry_id), 1, ex=ttl)
+            return
+        
+        blacklist = get_token_blacklist_collection()
+        await blacklist.insert_one({
+            "_id": entry_id,
+            "expires_at": expires_at,
+        })
+
+    @staticmethod
+    async def _claim_for_blacklist(token: str, expires_at: datetime) -> bool:
+        """Add token to the blacklist store, returning False if it was already there."""
+        entry_id = _blacklist_id(token)
+        redis = get_redis()
+        if redis is not None:
+            ttl = int((expires_at - datetime.now(timezone.utc)).total_seconds())
+            if ttl <= 0:
+                return False
+            claimed = await redis.set(_blacklist_key(entry_id), 1, ex=ttl, nx=True)
+        else:
+            blacklist = get_token_blacklist_collection()
+            try:
+                await blacklist.insert_one({
+                    "_id": entry_id,
+                    "expires_at": expires_at,
+                })
+                claimed = True
+            except DuplicateKeyError:
+                claimed = False
+        
+        _blacklist_cache[hash_token(token)] = True
+        return bool(claimed)
+
+    @staticmethod
+    async def migrate_blacklist_to_redis() -> None:
+        """Copy unexpired MongoDB blacklist entries to Redis, once."""
+        redis = get_redis()
+        if redis is None or await migration_applied("token_blacklist_to_redis"):
+            return
+        
+        blacklist = get_token_blacklist_collection()
+        now = datetime.now(timezone.utc)
+        count = 0
+        async with redis.pipeline(transaction=False) as pipe:
+            async for entry in blacklist.find({"expires_at": {"$gt": now}}):
+                expires_at = entry["expires_at"].replace(tzinfo=timezone.utc)
+                ttl = int((expires_at - now).total_seconds())
+                if ttl > 0:
+                    pipe.set(_blacklist_key(entry["_id"]), 1, ex=ttl)
+                    count += 1
+            await pipe.execute()
+        
+        await mark_migration_applied("token_blacklist_to_redis")
+        if count:
+            logger.info("Migrated %d blacklisted tokens to Redis", count)
+
     @staticmethod
     async def get_user_by_id(user_id: str) -> Optional[UserResponse]:
         """Get user by ID."""
         users = get_users_collection()
-        user = await users.find_one({"_id": user_id})
+        user = await users.find_one(id_filter(user_id))
         
         if not user:
             return None
         
         return UserResponse(
-            id=user["_id"],
+            id=str(user["_id"]),
             email=user["email"],
             role=UserRole(user.get("role", "user")),
             is_active=user.get("is_active", True),
@@ -142,15 +320,57 @@ class AuthService:
         )
 
     @staticmethod
-    async def get_user_by_email(email: str) -> Optional[dict]:
+    async def get_user_from_token(payload: TokenPayload) -> Optional[UserResponse]:
+        """Get user from access token claims, loading it only if the claims are stale."""
+        if payload.ver is None or payload.role is None:
+            return await AuthService.get_user_by_id(payload.sub)
+        
+        version = await AuthService.get_token_version(payload.sub)
+        if version is None:
+            return None
+        if version != payload.ver:
+            return await AuthService.get_user_by_id(payload.sub)
+        
+        # Deactivation bumps the version, so matching claims imply an active user
+        return UserResponse(
+            id=payload.sub,
+            email=payload.email,
+            role=payload.role,
+            is_active=True,
+            created_at=payload.created_at,
+        )
+
+    @staticmethod
+    async def get_token_version(user_id: str) -> Optional[int]:
+        """Get the user's current token version, or None if the user doesn't exist."""
+        version = _token_version_cache.get(user_id)
+        if version is not None:
+            return version
+        
+        users = get_users_collection()
+        user = await users.find_one(id_filter(user_id), {"token_version": 1})
+        if not user:
+            return None
+        
+        version = user.get("token_version", 0)
+        _token_version_cache[user_id] = version
+        return version
+
+    @staticmethod
+    def invalidate_token_version(user_id: str) -> None:
+        """Forget the cached token version after the user changed."""
+        _token_version_cache.pop(user_id, None)
+
+    @staticmethod
+    async def get_user_by_email(email: str, projection: Optional[dict] = None) -> Optional[dict]:
         """Get user by email (internal use)."""
         users = get_users_collection()
-        return await users.find_one({"email": email})
+        return await users.find_one({"email": email}, projection)
 
     @staticmethod
     async def create_admin_user(email: str, password: str) -> Optional[UserResponse]:
         """Create super admin user if not exists."""
-        existing = await AuthService.get_user_by_email(email)
+        existing = await AuthService.get_user_by_email(email, {"_id": 1})
         if existing:
             print(f"Admin user already exists: {email}")
             return None
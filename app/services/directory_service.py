@@ -1,11 +1,36 @@
+import asyncio
+import logging
+import re
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Dict, Optional, List, Set, Tuple
 from bson import ObjectId
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError
 
-from app.db.mongodb import get_directories_collection, get_files_collection, get_permissions_collection
+from app.core.request_cache import get_request_loader
+from app.db.mongodb import mongodb, get_directories_collection, get_files_collection, get_permissions_collection
+from app.db.s3 import get_s3_client
 from app.models.directory import DirectoryCreate, DirectoryResponse, DirectoryTree
+from app.models.permission import PermissionType
 from app.models.role import UserRole
 
+logger = logging.getLogger(__name__)
+
+# Directory ID -> (owner_id, is_public), for the hot permission checks
+_dir_meta_cache: TTLCache = TTLCache(maxsize=50000, ttl=30)
+
+# Fields needed to build a DirectoryResponse, plus the ancestor chain for permission checks
+_DIRECTORY_PROJECTION = {
+    "name": 1,
+    "path": 1,
+    "parent_id": 1,
+    "parent_path": 1,
+    "ancestor_ids": 1,
+    "is_public": 1,
+    "owner_id": 1,
+    "created_at": 1,
+}
+
 
 class DirectoryService:
     """Service for directory operations."""
@@ -20,20 +45,16 @@ class DirectoryService:
         
         # Build path
         if data.parent_id:
-            parent = await directories.find_one({"_id": data.parent_id})
+            parent = await DirectoryService.get_directory_doc(data.parent_id)
             if not parent:
                 raise ValueError("Parent directory not found")
-            path = f"{parent['path']}/{data.name}"
+            parent_path = parent["path"]
+            # Nearest ancestor first; unknown when the parent predates ancestor_ids
+            ancestor_ids = [data.parent_id, *parent["ancestor_ids"]] if "ancestor_ids" in parent else None
         else:
-            path = f"/{data.name}"
-        
-        # Check for duplicate path for this user
-        existing = await directories.find_one({
-            "owner_id": owner_id,
-            "path": path,
-        })
-        if existing:
-            raise ValueError("Directory with this name already exists at this location")
+            parent_path = ""
+            ancestor_ids = []
+        path = f"{parent_path}/{data.name}"
         
         # Create directory document
         dir_doc = {
@@ -41,12 +62,22 @@ class DirectoryService:
             "name": data.name,
             "owner_id": owner_id,
             "parent_id": data.parent_id,
+            "parent_path": parent_path,
             "path": path,
             "is_public": data.is_public,
             "created_at": datetime.now(timezone.utc),
         }
-        
-        await directories.insert_one(dir_doc)
+        if ancestor_ids is not None:
+            dir_doc["ancestor_ids"] = ancestor_ids
+        
+        # The unique (owner_id, path) index rejects duplicates atomically; check by
+        # query on deployments that haven't run the migration that adds it yet
+        if not mongodb.unique_directory_paths:
+            await DirectoryService._check_path_free(owner_id, path)
+        try:
+            await directories.insert_one(dir_doc)
+        except DuplicateKeyError:
+            raise ValueError("Directory with this name already exists at this location")
         
         return DirectoryResponse(
             id=dir_doc["_id"],
@@ -58,11 +89,21 @@ class DirectoryService:
             created_at=dir_doc["created_at"],
         )
 
+    @staticmethod
+    async def _check_path_free(owner_id: str, path: str, directory_id: Optional[str] = None) -> None:
+        """Raise ValueError if another of the owner's directories has this path."""
+        directories = get_directories_collection()
+        existing = await directories.find_one(
+            {"owner_id": owner_id, "path": path, "_id": {"$ne": directory_id}},
+            {"_id": 1},
+        )
+        if existing:
+            raise ValueError("Directory with this name already exists at this location")
+
     @staticmethod
     async def get_directory(directory_id: str) -> Optional[DirectoryResponse]:
         """Get a directory by ID."""
-        directories = get_directories_collection()
-        dir_doc = await directories.find_one({"_id": directory_id})
+        dir_doc = await DirectoryService.get_directory_doc(directory_id)
         
         if not dir_doc:
             return None
@@ -83,27 +124,32 @@ class DirectoryService:
         directories = get_directories_collection()
         permissions = get_permissions_collection()
         
-        result = []
-        
         # Super admin sees all directories
         if user_role == UserRole.SUPER_ADMIN:
-            cursor = directories.find({})
-            async for d in cursor:
-                result.append(DirectoryResponse(
-                    id=d["_id"],
-                    name=d["name"],
-                    path=d["path"],
-                    parent_id=d.get("parent_id"),
-                    is_public=d.get("is_public", False),
-                    owner_id=d["owner_id"],
-                    created_at=d["created_at"],
-                ))
-            return result
-        
-        # Get owned directories
-        owned_cursor = directories.find({"owner_id": user_id})
-        async for d in owned_cursor:
-            result.append(DirectoryResponse(
+            docs = await directories.find({}, _DIRECTORY_PROJECTION).to_list(length=None)
+        else:
+            # Owned/public directories and shared directory IDs are independent, load them concurrently
+            docs, shared_perms = await asyncio.gather(
+                directories.find(
+                    {"$or": [{"owner_id": user_id}, {"is_public": True}]},
+                    _DIRECTORY_PROJECTION,
+                ).to_list(length=None),
+                permissions.find(
+                    {"user_id": user_id},
+                    {"directory_id": 1},
+                ).to_list(length=None),
+            )
+            
+            if shared_perms:
+                docs += await DirectoryService._get_shared_directories(
+                    user_id,
+                    [p["directory_id"] for p in shared_perms],
+                    {d["_id"] for d in docs},
+                )
+        
+        # Documents come from our own collection, skip re-validating every field
+        return [
+            DirectoryResponse.model_construct(
                 id=d["_id"],
                 name=d["name"],
                 path=d["path"],
@@ -111,68 +157,77 @@ class DirectoryService:
                 is_public=d.get("is_public", False),
                 owner_id=d["owner_id"],
                 created_at=d["created_at"],
-            ))
-        
-        result_ids = {r.id for r in result}
-        
-        # Get public directories
-        public_cursor = directories.find({"is_public": True})
-        async for d in public_cursor:
-            if d["_id"] not in result_ids:
-                result.append(DirectoryResponse(
-                    id=d["_id"],
-                    name=d["name"],
-                    path=d["path"],
-                    parent_id=d.get("parent_id"),
-                    is_public=True,
-                    owner_id=d["owner_id"],
-                    created_at=d["created_at"],
-                ))
-                result_ids.add(d["_id"])
-        
-        # Get shared directories
-        shared_perms = permissions.find({"user_id": user_id})
-        shared_ids = [p["directory_id"] async for p in shared_perms]
-        
-        if shared_ids:
-            shared_cursor = directories.find({"_id": {"$in": shared_ids}})
-            async for d in shared_cursor:
-                if d["_id"] not in result_ids:
-                    result.append(DirectoryResponse(
-                        id=d["_id"],
-                        name=d["name"],
-                        path=d["path"],
-                        parent_id=d.get("parent_id"),
-                        is_public=d.get("is_public", False),
-                        owner_id=d["owner_id"],
-                        created_at=d["created_at"],
-                    ))
-        
-        return result
+            )
+            for d in docs
+        ]
+
+    @staticmethod
+    async def _get_shared_directories(user_id: str, granted_ids: List[str], seen: Set[str]) -> List[dict]:
+        """Get granted directories and their descendants the user can read, skipping those already seen."""
+        # Imported here: permission_service depends on this module
+        from app.services.permission_service import permission_service
+        
+        directories = get_directories_collection()
+        
+        # Grants are inherited, so subdirectories of a granted directory are candidates too
+        granted = await directories.aggregate([
+            {"$match": {"_id": {"$in": granted_ids}}},
+            {"$graphLookup": {
+                "from": "directories",
+                "startWith": "$_id",
+                "connectFromField": "_id",
+                "connectToField": "parent_id",
+                "as": "descendants",
+            }},
+            {"$project": {"descendants._id": 1}},
+        ]).to_list(length=None)
+        candidate_ids = {
+            d_id
+            for g in granted
+            for d_id in [g["_id"], *(d["_id"] for d in g["descendants"])]
+            if d_id not in seen
+        }
+        if not candidate_ids:
+            return []
+        
+        # A closer grant without read hides a subtree, as it does for direct access
+        readable = await permission_service.bulk_check_permissions(
+            user_id, list(candidate_ids), PermissionType.READ,
+        )
+        if not readable:
+            return []
+        
+        return await directories.find(
+            {"_id": {"$in": list(readable)}},
+            _DIRECTORY_PROJECTION,
+        ).to_list(length=None)
 
     @staticmethod
     async def get_directory_tree(user_id: str, user_role: UserRole = UserRole.USER) -> List[DirectoryTree]:
         """Get directory tree for user."""
         all_dirs = await DirectoryService.get_user_directories(user_id, user_role)
         
-        # Build tree structure
-        dir_map = {d.id: DirectoryTree(
-            id=d.id,
-            name=d.name,
-            path=d.path,
-            parent_id=d.parent_id,
-            is_public=d.is_public,
-            owner_id=d.owner_id,
-            created_at=d.created_at,
-            children=[],
-        ) for d in all_dirs}
+        # Build tree structure; the fields were validated by DirectoryResponse already
+        dir_map = {}
+        for d in all_dirs:
+            dir_map[d.id] = DirectoryTree.model_construct(
+                id=d.id,
+                name=d.name,
+                path=d.path,
+                parent_id=d.parent_id,
+                is_public=d.is_public,
+                owner_id=d.owner_id,
+                created_at=d.created_at,
+                children=[],
+            )
         
         roots = []
-        for dir_tree in dir_map.values():
-            if dir_tree.parent_id and dir_tree.parent_id in dir_map:
-                dir_map[dir_tree.parent_id].children.append(dir_tree)
+        for d in all_dirs:
+            parent = dir_map.get(d.parent_id)
+            if parent is not None:
+                parent.children.append(dir_map[d.id])
             else:
-                roots.append(dir_tree)
+                roots.append(dir_map[d.id])
         
         return roots
 
@@ -187,7 +242,7 @@ class DirectoryService:
         """Update directory."""
         directories = get_directories_collection()
         
-        dir_doc = await directories.find_one({"_id": directory_id})
+        dir_doc = await DirectoryService.get_directory_doc(directory_id)
         if not dir_doc:
             return None
         
@@ -199,20 +254,91 @@ class DirectoryService:
         if name is not None:
             update_doc["name"] = name
             # Update path
-            if dir_doc.get("parent_id"):
-                parent = await directories.find_one({"_id": dir_doc["parent_id"]})
-                update_doc["path"] = f"{parent['path']}/{name}"
+            if "parent_path" in dir_doc:
+                parent_path = dir_doc["parent_path"]
+            elif dir_doc.get("parent_id"):
+                # Created before parent_path was stored
+                parent = await DirectoryService.get_directory_doc(dir_doc["parent_id"])
+                parent_path = parent["path"]
             else:
-                update_doc["path"] = f"/{name}"
+                parent_path = ""
+            update_doc["path"] = f"{parent_path}/{name}"
         
         if is_public is not None:
             update_doc["is_public"] = is_public
         
         if update_doc:
-            await directories.update_one({"_id": directory_id}, {"$set": update_doc})
+            if "path" in update_doc and not mongodb.unique_directory_paths:
+                await DirectoryService._check_path_free(dir_doc["owner_id"], update_doc["path"], directory_id)
+            try:
+                await directories.update_one({"_id": directory_id}, {"$set": update_doc})
+            except DuplicateKeyError:
+                raise ValueError("Directory with this name already exists at this location")
+            
+            changed_ids = [directory_id]
+            if update_doc.get("path", dir_doc["path"]) != dir_doc["path"]:
+                try:
+                    changed_ids += await DirectoryService._rewrite_descendant_paths(
+                        directory_id, dir_doc["path"], update_doc["path"],
+                    )
+                except DuplicateKeyError:
+                    # A descendant (e.g. one a collaborator owns) would collide; undo the rename
+                    await directories.update_one(
+                        {"_id": directory_id},
+                        {"$set": {"name": dir_doc["name"], "path": dir_doc["path"]}},
+                    )
+                    DirectoryService._invalidate(changed_ids)
+                    raise ValueError("Directory with this name already exists at this location")
+            DirectoryService._invalidate(changed_ids)
         
         return await DirectoryService.get_directory(directory_id)
 
+    @staticmethod
+    async def _rewrite_descendant_paths(directory_id: str, old_path: str, new_path: str) -> List[str]:
+        """Replace the old path prefix of all descendants in one update; returns their IDs.
+        
+        If a new path is already taken, descendants already moved are moved back
+        and the DuplicateKeyError is re-raised.
+        """
+        descendant_ids = await DirectoryService._get_descendant_ids(directory_id)
+        if not descendant_ids:
+            return []
+        
+        query = {"_id": {"$in": descendant_ids}}
+        try:
+            await DirectoryService._replace_path_prefix(query, old_path, new_path)
+        except DuplicateKeyError:
+            # update_many stops at the first conflict; revert the ones it got to
+            await DirectoryService._replace_path_prefix(
+                {**query, "path": {"$regex": f"^{re.escape(new_path)}/"}}, new_path, old_path,
+            )
+            raise
+        return descendant_ids
+
+    @staticmethod
+    async def _replace_path_prefix(query: dict, old_path: str, new_path: str) -> None:
+        """Swap the old_path prefix of path and parent_path for new_path on matching directories."""
+        directories = get_directories_collection()
+        
+        def rewrite(field: str) -> dict:
+            return {"$concat": [
+                new_path,
+                {"$substrCP": [field, len(old_path), {"$strLenCP": field}]},
+            ]}
+        
+        await directories.update_many(
+            query,
+            [{"$set": {
+                "path": rewrite("$path"),
+                # Directories created before parent_path was stored don't get one
+                "parent_path": {"$cond": [
+                    {"$eq": [{"$type": "$parent_path"}, "string"]},
+                    rewrite("$parent_path"),
+                    "$$REMOVE",
+                ]},
+            }}],
+        )
+
     @staticmethod
     async def delete_directory(
         directory_id: str,
@@ -226,7 +352,7 @@ class DirectoryService:
         permissions = get_permissions_collection()
         
         # Get directory
-        dir_doc = await directories.find_one({"_id": directory_id})
+        dir_doc = await DirectoryService.get_directory_doc(directory_id)
         if not dir_doc:
             return False
         
@@ -235,12 +361,12 @@ class DirectoryService:
             raise PermissionError("Not authorized to delete this directory")
         
         # Check for children
-        children = await directories.find_one({"parent_id": directory_id})
+        children = await directories.find_one({"parent_id": directory_id}, {"_id": 1})
         if children and not cascade:
             raise ValueError("Directory has subdirectories. Use cascade=true to delete all.")
         
         # Check for files
-        has_files = await files.find_one({"directory_id": directory_id})
+        has_files = await files.find_one({"directory_id": directory_id}, {"_id": 1})
         if has_files and not cascade:
             raise ValueError("Directory has files. Use cascade=true to delete all.")
         
@@ -249,20 +375,40 @@ class DirectoryService:
             descendant_ids = await DirectoryService._get_descendant_ids(directory_id)
             all_ids = [directory_id] + descendant_ids
             
-            # Delete all files in these directories
-            await files.delete_many({"directory_id": {"$in": all_ids}})
+            # All files in these directories, with their storage keys
+            file_docs = await files.find(
+                {"directory_id": {"$in": all_ids}},
+                {"s3_key": 1},
+            ).to_list(length=None)
+            s3_keys = [f["s3_key"] for f in file_docs]
             
-            # Delete all permissions
-            await permissions.delete_many({"directory_id": {"$in": all_ids}})
+            # Delete files, permissions, directories and stored objects concurrently
+            *_, failed_keys = await asyncio.gather(
+                files.delete_many({"directory_id": {"$in": all_ids}}),
+                permissions.delete_many({"directory_id": {"$in": all_ids}}),
+                directories.delete_many({"_id": {"$in": all_ids}}),
+                get_s3_client().delete_objects(s3_keys),
+            )
+            if failed_keys:
+                logger.warning(
+                    "Could not delete %d stored objects of directory %s: %s",
+                    len(failed_keys), directory_id, failed_keys,
+                )
             
-            # Delete all directories
-            await directories.delete_many({"_id": {"$in": all_ids}})
+            # Imported here: file_service depends on this module
+            from app.services.file_service import file_service
+            for f in file_docs:
+                file_service.invalidate_file_caches(f["_id"], f["s3_key"])
         else:
-            # Delete permissions
-            await permissions.delete_many({"directory_id": directory_id})
+            all_ids = [directory_id]
             
-            # Delete directory
-            await directories.delete_one({"_id": directory_id})
+            # Delete permissions and directory
+            await asyncio.gather(
+                permissions.delete_many({"directory_id": directory_id}),
+                directories.delete_one({"_id": directory_id}),
+            )
+        
+        DirectoryService._invalidate(all_ids)
         
         return True
 
@@ -270,32 +416,76 @@ class DirectoryService:
     async def _get_descendant_ids(directory_id: str) -> List[str]:
         """Get all descendant directory IDs."""
         directories = get_directories_collection()
-        result = []
-        queue = [directory_id]
-        
-        while queue:
-            parent_id = queue.pop(0)
-            children_cursor = directories.find({"parent_id": parent_id})
-            async for child in children_cursor:
-                child_id = child["_id"]
-                result.append(child_id)
-                queue.append(child_id)
-        
-        return result
+        
+        pipeline = [
+            {"$match": {"_id": directory_id}},
+            {"$graphLookup": {
+                "from": "directories",
+                "startWith": "$_id",
+                "connectFromField": "_id",
+                "connectToField": "parent_id",
+                "as": "descendants",
+            }},
+            {"$project": {"ids": "$descendants._id"}},
+        ]
+        docs = await directories.aggregate(pipeline).to_list(length=1)
+        
+        return docs[0]["ids"] if docs else []
+
+    @staticmethod
+    async def _load_directories(directory_ids: List[str]) -> Dict[str, dict]:
+        """Load several directory documents in one query."""
+        directories = get_directories_collection()
+        docs = await directories.find(
+            {"_id": {"$in": directory_ids}},
+            _DIRECTORY_PROJECTION,
+        ).to_list(length=None)
+        return {d["_id"]: d for d in docs}
+
+    @staticmethod
+    async def get_directory_doc(directory_id: str) -> Optional[dict]:
+        """Get a directory document, fetched at most once per request and batched with concurrent lookups."""
+        loader = get_request_loader("directories", DirectoryService._load_directories)
+        if loader is not None:
+            return await loader.load(directory_id)
+        
+        directories = get_directories_collection()
+        return await directories.find_one({"_id": directory_id}, _DIRECTORY_PROJECTION)
+
+    @staticmethod
+    def _invalidate(directory_ids: List[str]) -> None:
+        """Drop changed or deleted directories from the request and metadata caches."""
+        loader = get_request_loader("directories", DirectoryService._load_directories)
+        for directory_id in directory_ids:
+            _dir_meta_cache.pop(directory_id, None)
+            if loader is not None:
+                loader.clear(directory_id)
+
+    @staticmethod
+    async def _get_meta(directory_id: str) -> Optional[Tuple[str, bool]]:
+        """Get (owner_id, is_public) for a directory, cached briefly."""
+        meta = _dir_meta_cache.get(directory_id)
+        if meta is not None:
+            return meta
+        
+        dir_doc = await DirectoryService.get_directory_doc(directory_id)
+        if not dir_doc:
+            return None
+        
+        meta = (dir_doc["owner_id"], dir_doc.get("is_public", False))
+        _dir_meta_cache[directory_id] = meta
+        return meta
 
     @staticmethod
     async def is_owner(directory_id: str, user_id: str) -> bool:
         """Check if user is owner of directory."""
-        directories = get_directories_collection()
-        dir_doc = await directories.find_one({"_id": directory_id, "owner_id": user_id})
-        return dir_doc is not None
+        meta = await DirectoryService._get_meta(directory_id)
+        return meta is not None and meta[0] == user_id
 
     @staticmethod
     async def is_public(directory_id: str) -> bool:
         """Check if directory is public."""
-        directories = get_directories_collection()
-        dir_doc = await directories.find_one({"_id": directory_id})
-        return dir_doc.get("is_public", False) if dir_doc else False
-
+        meta = await DirectoryService._get_meta(directory_id)
+        return meta is not None and meta[1]
 
 directory_service = DirectoryService()
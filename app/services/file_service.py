@@ -1,9 +1,12 @@
 from datetime import datetime, timezone
 from typing import Optional, List
 from bson import ObjectId
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+import logging
 import uuid
 
-from app.db.mongodb import get_files_collection, get_directories_collection
+from app.db.mongodb import get_files_collection
 from app.db.s3 import get_s3_client
 from app.core.config import settings
 from app.models.file import (
@@ -14,6 +17,31 @@ from app.models.file import (
     FileUpdate,
 )
 from app.models.role import UserRole
+from app.services.directory_service import directory_service
+
+logger = logging.getLogger(__name__)
+
+# Validity advertised for presigned GET URLs; the S3 client caches and pads them
+URL_EXPIRES_IN = 3600
+
+# Confirmed file ID -> (s3_key, filename), so repeat downloads and previews skip MongoDB
+_file_key_cache: TTLCache = TTLCache(maxsize=50000, ttl=60)
+
+# Public file ID -> (s3_key, filename), so public hits skip MongoDB
+_public_file_cache: TTLCache = TTLCache(maxsize=50000, ttl=60)
+
+# Fields read by the service; leaves out sha256 and anything added later
+_FILE_PROJECTION = {
+    "filename": 1,
+    "content_type": 1,
+    "size": 1,
+    "directory_id": 1,
+    "created_at": 1,
+    "is_public": 1,
+    "owner_id": 1,
+    "s3_key": 1,
+    "confirmed": 1,
+}
 
 
 class FileService:
@@ -28,23 +56,26 @@ class FileService:
         """Update file status."""
         files = get_files_collection()
         
-        file_doc = await files.find_one({"_id": file_id})
-        if not file_doc:
-            return None
-            
         update_doc = {}
         if update_data.is_public is not None:
             update_doc["is_public"] = update_data.is_public
-            
-        if not update_doc:
-            return FileResponse(**file_doc)
-            
-        await files.update_one(
-            {"_id": file_id},
-            {"$set": update_doc}
-        )
         
-        updated_doc = await files.find_one({"_id": file_id})
+        if update_doc:
+            # Update and read back in one round-trip
+            updated_doc = await files.find_one_and_update(
+                {"_id": file_id},
+                {"$set": update_doc},
+                projection=_FILE_PROJECTION,
+                return_document=ReturnDocument.AFTER,
+            )
+            if updated_doc:
+                FileService.invalidate_file_caches(file_id)
+        else:
+            updated_doc = await files.find_one({"_id": file_id}, _FILE_PROJECTION)
+        
+        if not updated_doc:
+            return None
+        
         return FileResponse(
             id=updated_doc["_id"],
             filename=updated_doc["filename"],
@@ -55,12 +86,25 @@ class FileService:
             is_public=updated_doc.get("is_public", False),
         )
 
+    @staticmethod
+    def invalidate_file_caches(file_id: str, s3_key: Optional[str] = None) -> None:
+        """Drop cached metadata and presigned URLs for a file."""
+        for cache in (_file_key_cache, _public_file_cache):
+            cached = cache.pop(file_id, None)
+            if cached is not None:
+                s3_key = s3_key or cached[0]
+        if s3_key:
+            get_s3_client().invalidate_presigned_get_urls(s3_key)
+
     @staticmethod
     async def get_public_file(file_id: str) -> Optional[dict]:
         """Get public file document."""
         files = get_files_collection()
-        print(f"DEBUG: Finding public file {file_id}")
-        return await files.find_one({"_id": file_id, "confirmed": True, "is_public": True})
+        logger.debug("Finding public file %s", file_id)
+        return await files.find_one(
+            {"_id": file_id, "confirmed": True, "is_public": True},
+            _FILE_PROJECTION,
+        )
 
     @staticmethod
     def _validate_mime_type(content_type: str) -> bool:
@@ -88,8 +132,7 @@ class FileService:
             raise ValueError(f"File size exceeds limit of {max_mb}MB")
         
         # Check directory exists
-        directories = get_directories_collection()
-        directory = await directories.find_one({"_id": data.directory_id})
+        directory = await directory_service.get_directory_doc(data.directory_id)
         if not directory:
             raise ValueError("Directory not found")
         
@@ -116,7 +159,7 @@ class FileService:
         
         # Generate presigned URL
         s3_client = get_s3_client()
-        presigned_url = s3_client.generate_presigned_put_url(
+        presigned_url = await s3_client.generate_presigned_put_url(
             key=s3_key,
             content_type=data.content_type,
             expires_in=3600,
@@ -138,7 +181,7 @@ class FileService:
         files = get_files_collection()
         
         # Get file record
-        file_doc = await files.find_one({"_id": file_id})
+        file_doc = await files.find_one({"_id": file_id}, _FILE_PROJECTION)
         if not file_doc:
             raise ValueError("File not found")
         
@@ -150,16 +193,18 @@ class FileService:
         
         # Verify file exists in S3
         s3_client = get_s3_client()
-        if not s3_client.check_object_exists(file_doc["s3_key"]):
+        if not await s3_client.check_object_exists(file_doc["s3_key"]):
             # Delete the record since upload failed
             await files.delete_one({"_id": file_id})
             raise ValueError("File not found in storage. Upload may have failed.")
         
-        # Update file record
-        await files.update_one(
-            {"_id": file_id},
+        # Update file record, unless another request confirmed it in the meantime
+        result = await files.update_one(
+            {"_id": file_id, "owner_id": user_id, "confirmed": False},
             {"$set": {"confirmed": True, "sha256": sha256}},
         )
+        if result.matched_count == 0:
+            raise ValueError("File already confirmed")
         
         return FileResponse(
             id=file_doc["_id"],
@@ -171,52 +216,86 @@ class FileService:
         )
 
     @staticmethod
-    async def get_download_url(
+    async def _get_presigned_get_url(
         file_id: str,
+        content_disposition: str,
     ) -> FileDownloadResponse:
-        """Get presigned URL for file download."""
-        files = get_files_collection()
-        
-        file_doc = await files.find_one({"_id": file_id, "confirmed": True})
-        if not file_doc:
-            raise ValueError("File not found")
+        """Get a presigned GET URL for a confirmed file."""
+        file_key = _file_key_cache.get(file_id)
+        if file_key is None:
+            files = get_files_collection()
+            
+            file_doc = await files.find_one(
+                {"_id": file_id, "confirmed": True},
+                {"s3_key": 1, "filename": 1},
+            )
+            if not file_doc:
+                raise ValueError("File not found")
+            
+            file_key = (file_doc["s3_key"], file_doc["filename"])
+            _file_key_cache[file_id] = file_key
         
+        s3_key, filename = file_key
         s3_client = get_s3_client()
-        presigned_url = s3_client.generate_presigned_get_url(
-            key=file_doc["s3_key"],
-            expires_in=3600,
-            filename=file_doc["filename"],
+        presigned_url = await s3_client.generate_presigned_get_url(
+            key=s3_key,
+            expires_in=URL_EXPIRES_IN,
+            filename=filename,
+            content_disposition=content_disposition,
         )
         
         return FileDownloadResponse(
             presigned_url=presigned_url,
-            filename=file_doc["filename"],
-            expires_in=3600,
+            filename=filename,
+            expires_in=URL_EXPIRES_IN,
         )
 
+    @staticmethod
+    async def get_download_url(
+        file_id: str,
+    ) -> FileDownloadResponse:
+        """Get presigned URL for file download."""
+        return await FileService._get_presigned_get_url(file_id, "attachment")
+
     @staticmethod
     async def get_preview_url(
         file_id: str,
     ) -> FileDownloadResponse:
         """Get presigned URL for file preview (inline)."""
-        files = get_files_collection()
-        
-        file_doc = await files.find_one({"_id": file_id, "confirmed": True})
-        if not file_doc:
-            raise ValueError("File not found")
+        return await FileService._get_presigned_get_url(file_id, "inline")
+
+    @staticmethod
+    async def get_public_preview_url(
+        file_id: str,
+    ) -> FileDownloadResponse:
+        """Get presigned URL for public file preview (inline)."""
+        public_file = _public_file_cache.get(file_id)
+        if public_file is None:
+            files = get_files_collection()
+            
+            file_doc = await files.find_one(
+                {"_id": file_id, "confirmed": True, "is_public": True},
+                {"s3_key": 1, "filename": 1},
+            )
+            if not file_doc:
+                raise ValueError("File not found or not public")
+            
+            public_file = (file_doc["s3_key"], file_doc["filename"])
+            _public_file_cache[file_id] = public_file
         
+        s3_key, filename = public_file
         s3_client = get_s3_client()
-        presigned_url = s3_client.generate_presigned_get_url(
-            key=file_doc["s3_key"],
-            expires_in=3600,
-            filename=file_doc["filename"],
+        presigned_url = await s3_client.generate_presigned_get_url(
+            key=s3_key,
+            expires_in=URL_EXPIRES_IN,
+            filename=filename,
             content_disposition="inline",
         )
         
         return FileDownloadResponse(
             presigned_url=presigned_url,
-            filename=file_doc["filename"],
-            expires_in=3600,
+            filename=filename,
+            expires_in=URL_EXPIRES_IN,
         )
 
     @staticmethod
@@ -228,7 +307,7 @@ class FileService:
         """Delete a file."""
         files = get_files_collection()
         
-        file_doc = await files.find_one({"_id": file_id})
+        file_doc = await files.find_one({"_id": file_id}, {"owner_id": 1, "s3_key": 1})
         if not file_doc:
             return False
         
@@ -237,10 +316,11 @@ class FileService:
         
         # Delete from S3
         s3_client = get_s3_client()
-        s3_client.delete_object(file_doc["s3_key"])
+        await s3_client.delete_object(file_doc["s3_key"])
         
         # Delete from database
         await files.delete_one({"_id": file_id})
+        FileService.invalidate_file_caches(file_id, file_doc["s3_key"])
         
         return True
 
@@ -249,29 +329,45 @@ class FileService:
         """List all confirmed files in a directory."""
         files = get_files_collection()
         
-        cursor = files.find({
-            "directory_id": directory_id,
-            "confirmed": True,
-        })
+        docs = await files.find(
+            {"directory_id": directory_id, "confirmed": True},
+            {
+                "filename": 1,
+                "content_type": 1,
+                "size": 1,
+                "directory_id": 1,
+                "created_at": 1,
+            },
+        ).to_list(length=None)
         
-        result = []
-        async for file_doc in cursor:
-            result.append(FileResponse(
+        # Documents come from our own collection, skip re-validating every field
+        return [
+            FileResponse.model_construct(
                 id=file_doc["_id"],
                 filename=file_doc["filename"],
                 content_type=file_doc["content_type"],
                 size=file_doc["size"],
                 directory_id=file_doc["directory_id"],
                 created_at=file_doc["created_at"],
-            ))
-        
-        return result
+            )
+            for file_doc in docs
+        ]
 
     @staticmethod
     async def get_file(file_id: str) -> Optional[dict]:
         """Get file document."""
         files = get_files_collection()
-        return await files.find_one({"_id": file_id, "confirmed": True})
+        return await files.find_one({"_id": file_id, "confirmed": True}, _FILE_PROJECTION)
+
+    @staticmethod
+    async def get_file_dir(file_id: str) -> Optional[str]:
+        """Get the directory ID of a confirmed file."""
+        files = get_files_collection()
+        file_doc = await files.find_one(
+            {"_id": file_id, "confirmed": True},
+            {"directory_id": 1, "_id": 0},
+        )
+        return file_doc["directory_id"] if file_doc else None
 
 
 file_service = FileService()
@@ -1,10 +1,20 @@
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Dict, Iterable, Optional, List, Set, Tuple
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 from app.db.mongodb import get_permissions_collection, get_directories_collection, get_users_collection
+from app.services.directory_service import directory_service
 from app.models.permission import PermissionType, PermissionGrant, PermissionResponse
 
+# Fields needed to build a PermissionResponse
+_PERMISSION_PROJECTION = {
+    "user_id": 1,
+    "directory_id": 1,
+    "permissions": 1,
+    "created_at": 1,
+}
+
 
 class PermissionService:
     """Service for permission operations."""
@@ -18,10 +28,9 @@ class PermissionService:
         """Grant permissions to a user for a directory."""
         permissions = get_permissions_collection()
         users = get_users_collection()
-        directories = get_directories_collection()
         
         # Check directory exists
-        directory = await directories.find_one({"_id": directory_id})
+        directory = await directory_service.get_directory_doc(directory_id)
         if not directory:
             raise ValueError("Directory not found")
         
@@ -30,44 +39,31 @@ class PermissionService:
             raise PermissionError("Only directory owner can grant permissions")
         
         # Get user by email
-        user = await users.find_one({"email": data.user_email})
+        user = await users.find_one({"email": data.user_email}, {"_id": 1})
         if not user:
             raise ValueError("User not found")
         
-        user_id = user["_id"]
+        user_id = str(user["_id"])
         
         # Can't grant permissions to self
         if user_id == granted_by:
             raise ValueError("Cannot grant permissions to yourself")
         
-        # Check if permission already exists
-        existing = await permissions.find_one({
-            "user_id": user_id,
-            "directory_id": directory_id,
-        })
-        
-        if existing:
-            # Update existing permission
-            await permissions.update_one(
-                {"_id": existing["_id"]},
-                {"$set": {"permissions": [p.value for p in data.permissions]}},
-            )
-            perm_id = existing["_id"]
-        else:
-            # Create new permission
-            perm_doc = {
-                "_id": str(ObjectId()),
-                "user_id": user_id,
-                "directory_id": directory_id,
-                "permissions": [p.value for p in data.permissions],
-                "granted_by": granted_by,
-                "created_at": datetime.now(timezone.utc),
-            }
-            await permissions.insert_one(perm_doc)
-            perm_id = perm_doc["_id"]
-        
-        # Get updated permission
-        perm = await permissions.find_one({"_id": perm_id})
+        # Update the existing permission or create it, and read it back in one operation
+        perm = await permissions.find_one_and_update(
+            {"user_id": user_id, "directory_id": directory_id},
+            {
+                "$set": {"permissions": [p.value for p in data.permissions]},
+                "$setOnInsert": {
+                    "_id": str(ObjectId()),
+                    "granted_by": granted_by,
+                    "created_at": datetime.now(timezone.utc),
+                },
+            },
+            projection=_PERMISSION_PROJECTION,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
         
         return PermissionResponse(
             id=perm["_id"],
@@ -86,10 +82,9 @@ class PermissionService:
     ) -> bool:
         """Revoke all permissions for a user on a directory."""
         permissions = get_permissions_collection()
-        directories = get_directories_collection()
         
         # Check directory exists and user is owner
-        directory = await directories.find_one({"_id": directory_id})
+        directory = await directory_service.get_directory_doc(directory_id)
         if not directory:
             raise ValueError("Directory not found")
         
@@ -109,26 +104,121 @@ class PermissionService:
     ) -> List[PermissionResponse]:
         """Get all permissions for a directory."""
         permissions = get_permissions_collection()
-        users = get_users_collection()
         
-        cursor = permissions.find({"directory_id": directory_id})
+        pipeline = [
+            {"$match": {"directory_id": directory_id}},
+            # User IDs are stored as strings; user _ids are ObjectIds or legacy strings
+            {"$addFields": {"user_keys": [
+                "$user_id",
+                {"$convert": {"input": "$user_id", "to": "objectId", "onError": "$user_id"}},
+            ]}},
+            {"$lookup": {
+                "from": "users",
+                "localField": "user_keys",
+                "foreignField": "_id",
+                "pipeline": [{"$project": {"email": 1}}],
+                "as": "user",
+            }},
+            {"$project": {
+                **_PERMISSION_PROJECTION,
+                "user_email": {"$ifNull": [{"$first": "$user.email"}, "unknown"]},
+            }},
+        ]
+        perms = await permissions.aggregate(pipeline).to_list(length=None)
         
-        result = []
-        async for perm in cursor:
-            # Get user email
-            user = await users.find_one({"_id": perm["user_id"]})
-            user_email = user["email"] if user else "unknown"
-            
-            result.append(PermissionResponse(
+        # Documents come from our own collection, skip re-validating every field
+        return [
+            PermissionResponse.model_construct(
                 id=perm["_id"],
                 user_id=perm["user_id"],
-                user_email=user_email,
+                user_email=perm["user_email"],
                 directory_id=perm["directory_id"],
                 permissions=[PermissionType(p) for p in perm["permissions"]],
                 created_at=perm["created_at"],
-            ))
+            )
+            for perm in perms
+        ]
+
+    @staticmethod
+    async def _get_grants(
+        user_id: str,
+        directory_ids: Iterable[str],
+    ) -> Dict[str, List[str]]:
+        """Get the user's granted permissions for several directories in one query."""
+        permissions = get_permissions_collection()
+        grants = await permissions.find(
+            {"user_id": user_id, "directory_id": {"$in": list(directory_ids)}},
+            {"directory_id": 1, "permissions": 1},
+        ).to_list(length=None)
+        return {p["directory_id"]: p["permissions"] for p in grants}
+
+    @staticmethod
+    async def _get_directory_with_grant(
+        user_id: str,
+        directory_id: str,
+    ) -> Optional[Tuple[dict, Optional[List[str]]]]:
+        """Get a directory and the user's closest grant on it or its ancestors."""
+        directory = await directory_service.get_directory_doc(directory_id)
+        if not directory:
+            return None
         
-        return result
+        # Owners need no grant
+        if directory["owner_id"] == user_id:
+            return directory, None
+        
+        if "ancestor_ids" in directory:
+            path_ids = [directory_id, *directory["ancestor_ids"]]
+            grants = await PermissionService._get_grants(user_id, path_ids)
+            
+            # Most specific grant wins
+            for dir_id in path_ids:
+                if dir_id in grants:
+                    return directory, grants[dir_id]
+            return directory, None
+        
+        # Directories created before ancestor_ids: walk the tree on the server
+        directories = get_directories_collection()
+        
+        pipeline = [
+            {"$match": {"_id": directory_id}},
+            {"$graphLookup": {
+                "from": "directories",
+                "startWith": "$parent_id",
+                "connectFromField": "parent_id",
+                "connectToField": "_id",
+                "as": "ancestors",
+                "depthField": "depth",
+            }},
+            {"$addFields": {"path_ids": {"$concatArrays": [["$_id"], "$ancestors._id"]}}},
+            {"$lookup": {
+                "from": "permissions",
+                "localField": "path_ids",
+                "foreignField": "directory_id",
+                "pipeline": [
+                    {"$match": {"user_id": user_id}},
+                    {"$project": {"directory_id": 1, "permissions": 1}},
+                ],
+                "as": "grants",
+            }},
+            {"$project": {
+                "owner_id": 1,
+                "ancestors._id": 1,
+                "ancestors.depth": 1,
+                "grants": 1,
+            }},
+        ]
+        docs = await directories.aggregate(pipeline).to_list(length=1)
+        if not docs:
+            return None
+        
+        directory = docs[0]
+        
+        # Most specific grant wins: the directory itself, then the nearest ancestor
+        depths = {a["_id"]: a["depth"] for a in directory["ancestors"]}
+        depths[directory["_id"]] = -1
+        grants = sorted(directory["grants"], key=lambda g: depths[g["directory_id"]])
+        
+        return directory, grants[0]["permissions"] if grants else None
 
     @staticmethod
     async def check_permission(
@@ -137,39 +227,69 @@ class PermissionService:
         permission_type: PermissionType,
     ) -> bool:
         """Check if user has specific permission on directory (including inheritance)."""
-        directories = get_directories_collection()
-        permissions = get_permissions_collection()
-        
-        # Get directory
-        directory = await directories.find_one({"_id": directory_id})
-        if not directory:
+        found = await PermissionService._get_directory_with_grant(user_id, directory_id)
+        if not found:
             return False
         
+        directory, grant = found
+        
         # Owner has all permissions
         if directory["owner_id"] == user_id:
             return True
         
-        # Build path from directory to root
-        path_ids = [directory_id]
-        current = directory
-        
-        while current.get("parent_id"):
-            path_ids.append(current["parent_id"])
-            current = await directories.find_one({"_id": current["parent_id"]})
-            if not current:
-                break
-        
-        # Check permissions from most specific to least specific
-        for dir_id in path_ids:
-            perm = await permissions.find_one({
-                "user_id": user_id,
-                "directory_id": dir_id,
-            })
+        return grant is not None and permission_type.value in grant
+
+    @staticmethod
+    async def bulk_check_permissions(
+        user_id: str,
+        directory_ids: List[str],
+        permission_type: PermissionType,
+    ) -> Set[str]:
+        """Get the subset of directories the user has a permission on (including inheritance)."""
+        directories = get_directories_collection()
+        projection = {"owner_id": 1, "parent_id": 1, "ancestor_ids": 1}
+        
+        dir_map: Dict[str, dict] = {}
+        requested = set(directory_ids)
+        pending = set(directory_ids)
+        while pending:
+            docs = await directories.find({"_id": {"$in": list(pending)}}, projection).to_list(length=None)
+            dir_map.update((d["_id"], d) for d in docs)
+            # Directories created before ancestor_ids: load their parents, one query per level
+            pending = {
+                d["parent_id"] for d in docs
+                if "ancestor_ids" not in d and d.get("parent_id") and d["parent_id"] not in requested
+            }
+            requested |= pending
+        
+        def path_ids(directory: dict) -> List[str]:
+            ids = []
+            current = directory
+            while current:
+                ids.append(current["_id"])
+                if "ancestor_ids" in current:
+                    return ids + current["ancestor_ids"]
+                current = dir_map.get(current.get("parent_id"))
+            return ids
+        
+        paths = {d_id: path_ids(dir_map[d_id]) for d_id in directory_ids if d_id in dir_map}
+        grants = await PermissionService._get_grants(
+            user_id, {d_id for ids in paths.values() for d_id in ids},
+        )
+        
+        result = set()
+        for directory_id, ids in paths.items():
+            # Owner has all permissions
+            if dir_map[directory_id]["owner_id"] == user_id:
+                result.add(directory_id)
+                continue
             
-            if perm:
-                return permission_type.value in perm["permissions"]
+            # Most specific grant wins
+            grant = next((grants[d_id] for d_id in ids if d_id in grants), None)
+            if grant is not None and permission_type.value in grant:
+                result.add(directory_id)
         
-        return False
+        return result
 
     @staticmethod
     async def get_effective_permissions(
@@ -177,39 +297,17 @@ class PermissionService:
         directory_id: str,
     ) -> List[PermissionType]:
         """Get all effective permissions for user on directory."""
-        directories = get_directories_collection()
-        permissions = get_permissions_collection()
-        
-        # Get directory
-        directory = await directories.find_one({"_id": directory_id})
-        if not directory:
+        found = await PermissionService._get_directory_with_grant(user_id, directory_id)
+        if not found:
             return []
         
+        directory, grant = found
+        
         # Owner has all permissions
         if directory["owner_id"] == user_id:
             return [PermissionType.READ, PermissionType.WRITE, PermissionType.DELETE]
         
-        # Build path from directory to root
-        path_ids = [directory_id]
-        current = directory
-        
-        while current.get("parent_id"):
-            path_ids.append(current["parent_id"])
-            current = await directories.find_one({"_id": current["parent_id"]})
-            if not current:
-                break
-        
-        # Check permissions from most specific to least specific
-        for dir_id in path_ids:
-            perm = await permissions.find_one({
-                "user_id": user_id,
-                "directory_id": dir_id,
-            })
-            
-            if perm:
-                return [PermissionType(p) for p in perm["permissions"]]
-        
-        return []
+        return [PermissionType(p) for p in grant] if grant else []
 
     @staticmethod
     async def can_access_directory(
@@ -217,9 +315,7 @@ class PermissionService:
         directory_id: str,
     ) -> bool:
         """Check if user can access directory (owner or has any permission)."""
-        directories = get_directories_collection()
-        
-        directory = await directories.find_one({"_id": directory_id})
+        directory = await directory_service.get_directory_doc(directory_id)
         if not directory:
             return False
         
@@ -1,51 +1,155 @@
-from typing import Optional, List
+import asyncio
+from typing import AsyncIterator, Dict, Optional, List
 from bson import ObjectId
+from cachetools import TTLCache
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
-from app.db.mongodb import get_users_collection
-from app.models.user import UserResponse, UserUpdate
+from app.core.request_cache import get_request_loader
+from app.core.security import get_password_hash
+from app.db.mongodb import get_users_collection, id_filter
+from app.models.user import UserBatchUpdate, UserResponse, UserUpdate
 from app.models.role import UserRole
+from app.services.auth_service import auth_service
+
+# User fields needed to build a UserResponse
+_USER_PROJECTION = {
+    "email": 1,
+    "role": 1,
+    "is_active": 1,
+    "created_at": 1,
+}
+
+# Listing order, served by the (created_at, _id) index when it exists
+_USER_LISTING_ORDER = [("created_at", 1), ("_id", 1)]
+
+# User ID -> UserResponse for repeat admin lookups; updates and deletes in this
+# process evict, other processes catch up within the TTL
+_user_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+# Stored role value -> UserRole, avoiding Enum lookups per row
+_ROLES = {role.value: role for role in UserRole}
+
+
+def _to_user_response(user: dict) -> UserResponse:
+    """Build a UserResponse from a projected user document without re-validating it."""
+    return UserResponse.model_construct(
+        id=str(user["_id"]),
+        email=user["email"],
+        role=_ROLES.get(user.get("role", "user"), UserRole.USER),
+        is_active=user.get("is_active", True),
+        created_at=user["created_at"],
+    )
+
+
+def _changed_filter(user_id: str, update_doc: dict) -> dict:
+    """Match the user only if the update would change a field, so no-op updates aren't written."""
+    return {
+        **id_filter(user_id),
+        "$or": [{field: {"$ne": value}} for field, value in update_doc.items()],
+    }
+
+
+def _to_user_dict(user: dict) -> dict:
+    """Build the JSON body of a UserResponse straight from a projected user document."""
+    return {
+        "id": str(user["_id"]),
+        "email": user["email"],
+        "role": _ROLES.get(user.get("role", "user"), UserRole.USER).value,
+        "is_active": user.get("is_active", True),
+        "created_at": user["created_at"].isoformat(),
+    }
 
 
 class UserService:
     """Service for user management operations (admin)."""
 
     @staticmethod
-    async def list_users(skip: int = 0, limit: int = 50) -> List[UserResponse]:
-        """List all users."""
+    async def list_users(
+        skip: int = 0,
+        limit: int = 50,
+        after_id: Optional[str] = None,
+    ) -> List[UserResponse]:
+        """List users ordered by creation, either by offset or after a given user."""
+        docs = await UserService._find_user_page(skip, limit, after_id)
+        return [_to_user_response(user) for user in docs]
+
+    @staticmethod
+    async def list_users_raw(
+        skip: int = 0,
+        limit: int = 50,
+        after_id: Optional[str] = None,
+    ) -> List[dict]:
+        """Like list_users, but as JSON-ready dicts for routes that skip response validation."""
+        docs = await UserService._find_user_page(skip, limit, after_id)
+        return [_to_user_dict(user) for user in docs]
+
+    @staticmethod
+    async def _find_user_page(skip: int, limit: int, after_id: Optional[str]) -> List[dict]:
+        """Fetch one page of projected user documents."""
         users = get_users_collection()
-        cursor = users.find().skip(skip).limit(limit)
         
-        result = []
+        query = {}
+        if after_id:
+            # Keyset pagination: seek past the cursor user on the (created_at, _id) index
+            if not ObjectId.is_valid(after_id):
+                return []
+            cursor_user = await users.find_one(id_filter(after_id), {"created_at": 1})
+            if not cursor_user:
+                return []
+            query = {"$or": [
+                {"created_at": {"$gt": cursor_user["created_at"]}},
+                {"created_at": cursor_user["created_at"], "_id": {"$gt": cursor_user["_id"]}},
+            ]}
+            skip = 0
+        
+        # One batch of exactly the page size: a single round-trip, nothing fetched past the page
+        return await users.find(query, _USER_PROJECTION).sort(
+            _USER_LISTING_ORDER
+        ).skip(skip).limit(limit).batch_size(limit).to_list(length=limit)
+
+    @staticmethod
+    async def iter_users(batch_size: int = 500) -> AsyncIterator[UserResponse]:
+        """Yield every user in listing order, holding one cursor batch in memory at a time."""
+        users = get_users_collection()
+        cursor = users.find({}, _USER_PROJECTION).sort(
+            _USER_LISTING_ORDER
+        ).batch_size(batch_size)
         async for user in cursor:
-            result.append(UserResponse(
-                id=user["_id"],
-                email=user["email"],
-                role=UserRole(user.get("role", "user")),
-                is_active=user.get("is_active", True),
-                created_at=user["created_at"],
-            ))
-        return result
+            yield _to_user_response(user)
 
     @staticmethod
     async def get_user(user_id: str) -> Optional[UserResponse]:
-        """Get user by ID."""
-        users = get_users_collection()
-        user = await users.find_one({"_id": user_id})
+        """Get user by ID, batched with concurrent lookups in the same request."""
+        # User IDs are always ObjectIds (legacy ones stored as their hex string),
+        # so anything else can't match and needs no round-trip
+        if not ObjectId.is_valid(user_id):
+            return None
+        
+        cached = _user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
+        loader = get_request_loader("users", UserService._load_users)
+        if loader is not None:
+            user = await loader.load(user_id)
+        else:
+            users = get_users_collection()
+            user = await users.find_one(id_filter(user_id), _USER_PROJECTION)
         
         if not user:
             return None
         
-        return UserResponse(
-            id=user["_id"],
-            email=user["email"],
-            role=UserRole(user.get("role", "user")),
-            is_active=user.get("is_active", True),
-            created_at=user["created_at"],
-        )
+        response = _to_user_response(user)
+        _user_cache[user_id] = response
+        return response
 
     @staticmethod
     async def update_user(user_id: str, update_data: UserUpdate) -> Optional[UserResponse]:
         """Update user role, status, email or password."""
+        if not ObjectId.is_valid(user_id):
+            return None
+        
         users = get_users_collection()
         
         # Build update document
@@ -55,40 +159,106 @@ class UserService:
         if update_data.is_active is not None:
             update_doc["is_active"] = update_data.is_active
         if update_data.email is not None:
-            # Check if email is taken by another user
-            existing = await users.find_one({"email": update_data.email})
-            if existing and existing["_id"] != user_id:
-                raise ValueError("Email already exists")
             update_doc["email"] = update_data.email
         if update_data.password is not None:
-            from app.core.security import get_password_hash
-            update_doc["hashed_password"] = get_password_hash(update_data.password)
+            update_doc["hashed_password"] = await asyncio.to_thread(
+                get_password_hash, update_data.password
+            )
         
+        # Nothing to change: echo the current user, normally from the user cache
+        # rather than the database
         if not update_doc:
             return await UserService.get_user(user_id)
         
-        result = await users.update_one(
-            {"_id": user_id},
-            {"$set": update_doc}
-        )
+        # Bump token_version so claims in issued access tokens are re-checked.
+        # The unique email index rejects an email taken by another user.
+        try:
+            user = await users.find_one_and_update(
+                _changed_filter(user_id, update_doc),
+                {"$set": update_doc, "$inc": {"token_version": 1}},
+                projection=_USER_PROJECTION,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            raise ValueError("Email already exists")
         
-        if result.matched_count == 0:
-            return None
+        if not user:
+            # Missing, or every field already had its new value and nothing was written
+            return await UserService.get_user(user_id)
+        
+        auth_service.invalidate_token_version(user_id)
+        UserService._invalidate(user_id)
+        
+        response = _to_user_response(user)
+        _user_cache[user_id] = response
+        return response
+
+    @staticmethod
+    async def batch_update_users(updates: List[UserBatchUpdate]) -> int:
+        """Update role and status for many users in one round-trip; returns how many changed."""
+        ops = []
+        user_ids = []
+        for update in updates:
+            update_doc = {}
+            if update.role is not None:
+                update_doc["role"] = update.role.value
+            if update.is_active is not None:
+                update_doc["is_active"] = update.is_active
+            if not update_doc or not ObjectId.is_valid(update.user_id):
+                continue
+            
+            ops.append(UpdateOne(
+                _changed_filter(update.user_id, update_doc),
+                {"$set": update_doc, "$inc": {"token_version": 1}},
+            ))
+            user_ids.append(update.user_id)
+        
+        if not ops:
+            return 0
         
-        return await UserService.get_user(user_id)
+        users = get_users_collection()
+        result = await users.bulk_write(ops, ordered=False)
+        for user_id in user_ids:
+            auth_service.invalidate_token_version(user_id)
+            UserService._invalidate(user_id)
+        return result.matched_count
 
     @staticmethod
     async def delete_user(user_id: str) -> bool:
         """Delete user."""
+        if not ObjectId.is_valid(user_id):
+            return False
+        
         users = get_users_collection()
-        result = await users.delete_one({"_id": user_id})
-        return result.deleted_count > 0
+        # Atomically remove and return the id, so caches are only touched for a real delete
+        user = await users.find_one_and_delete(id_filter(user_id), projection={"_id": 1})
+        if not user:
+            return False
+        
+        auth_service.invalidate_token_version(user_id)
+        UserService._invalidate(user_id)
+        return True
 
     @staticmethod
-    async def count_users() -> int:
-        """Count total users."""
+    async def _load_users(user_ids: List[str]) -> Dict[str, dict]:
+        """Load several user documents in one query, matching ObjectId and legacy string ids."""
+        lookup_ids = []
+        for user_id in user_ids:
+            lookup_ids.append(user_id)
+            if ObjectId.is_valid(user_id):
+                lookup_ids.append(ObjectId(user_id))
+        
         users = get_users_collection()
-        return await users.count_documents({})
+        docs = await users.find({"_id": {"$in": lookup_ids}}, _USER_PROJECTION).to_list(length=None)
+        return {str(d["_id"]): d for d in docs}
+
+    @staticmethod
+    def _invalidate(user_id: str) -> None:
+        """Drop a changed or deleted user from the request and process caches."""
+        _user_cache.pop(user_id, None)
+        loader = get_request_loader("users", UserService._load_users)
+        if loader is not None:
+            loader.clear(user_id)
 
 
 user_service = UserService()